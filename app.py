@@ -3,32 +3,55 @@ CP-Tekniker Device Management App
 
 Hoved-entrépunkt for Flask-applikasjonen. Initialiserer appen, laster konfigurasjon,
 registrerer blueprints for autentisering og ClearPass-funksjonalitet, og sentraliserer feil- og rate limit-håndtering.
+Tunge moduler som kun trengs ved enkelte kall (ClearPass-klientens requests, e-postbygging) lastes lazy;
+warm_up() laster dem og bygger delt tilstand i gunicorn-masteren før fork når preload_app er på.
 """
 
+import importlib
+
 from flask import Flask, render_template, session, request, jsonify
-from flask_session import Session
 from config import Config
-from flask_limiter.errors import RateLimitExceeded
+from utils import assets, compression, metrics, sessions
 
 # Initialize Flask app
 app = Flask(__name__)
 app.config.from_object(Config)
 app.secret_key = Config.SECRET_KEY
-Session(app)
+compression.init_app(app)  # Registreres først slik at komprimeringen kjører etter de andre after_request-hookene
+sessions.init_app(app)
+metrics.init_app(app)
+assets.init_app(app)  # Hashede, forhåndskomprimerte statiske filer under /assets/
 
 # Registrerer alle blueprints for modulær struktur
 from auth.routes import bp as auth_bp  # Autentisering (login, logout, kode)
 from clearpass.api import bp as clearpass_api_bp  # ClearPass API-endepunkter (device info, opprettelse)
 from clearpass.routes import bp as clearpass_routes_bp  # Rolle-endepunkt
+from clearpass.bulk import bp as clearpass_bulk_bp  # Masseimport av enheter
 
 app.register_blueprint(auth_bp)
 app.register_blueprint(clearpass_api_bp)
 app.register_blueprint(clearpass_routes_bp)
+app.register_blueprint(clearpass_bulk_bp)
 
 # Etter at app er initialisert og blueprints er registrert:
-from auth.limiter import limiter
+from auth.limiter import RateLimitExceeded, limiter
 limiter.init_app(app)
 
+from clearpass import breaker, replay  # Circuit breaker-status og kø for /health
+
+# Lazy-lastede moduler som likevel importeres i gunicorn-masteren ved preload, slik at workerne deler dem
+PRELOAD_MODULES = ("requests", "requests.adapters")
+
+def warm_up():
+    """Bygger delt, uforanderlig tilstand før gunicorn forker workere (kalles fra gunicorn.conf.py).
+    Workerne arver modulene, domeneindeksen og den kompilerte malen via copy-on-write.
+    """
+    from clearpass.roles import approved_index
+    for name in PRELOAD_MODULES:
+        importlib.import_module(name)
+    approved_index.preload()
+    app.jinja_env.get_template("index.html")
+
 @app.route("/")
 def home():
     """Rendrer hovedsiden (index.html). Viser login eller beskyttet innhold avhengig av sesjon."""
@@ -40,31 +63,33 @@ def is_logged_in():
     # Forutsetter at e-post lagres i session["email"] ved login
     return jsonify({
         "logged_in": bool(session.get("logged_in")),
-        "email": session.get("email", "")
+        "email": session.get("email", ""),
+        "clearpass": breaker.status()["state"],
+    })
+
+@app.route("/health", methods=["GET"])
+def health():
+    """Helsesjekk. Svarer alltid 200 mens appen kjører; status er "degraded" når ClearPass-breakeren er åpen."""
+    clearpass = breaker.status()
+    return jsonify({
+        "status": "ok" if clearpass["state"] == breaker.CLOSED else "degraded",
+        "clearpass": clearpass,
+        "queued_changes": replay.pending(),
     })
 
 @app.errorhandler(RateLimitExceeded)
 def handle_rate_limit(e):
     """Sentralisert håndtering av rate limiting. Returnerer brukervennlig feilmelding og retry-after."""
-    retry_after = None
-    if hasattr(e, 'retry_after') and e.retry_after:
-        retry_after = int(e.retry_after)
-    else:
-        retry_after_header = request.headers.get('Retry-After')
-        if retry_after_header:
-            try:
-                retry_after = int(retry_after_header)
-            except Exception:
-                retry_after = None
-        if retry_after is None:
-            import re as _re
-            match = _re.search(r'(\d+)$', str(e.description))
-            if match:
-                retry_after = int(match.group(1))
-    if retry_after is None:
-        retry_after = 60
+    retry_after = e.retry_after
+    metrics.RATE_LIMIT_REJECTIONS.labels(request.endpoint or "unmatched").inc()
     message = f"Du har nådd grensen for antall forespørsler. Du kan prøve igjen om {retry_after} sekunder."
-    return jsonify({
+    response = jsonify({
         "error": message,
         "retry_after": retry_after
-    }), 429
+    })
+    response.status_code = 429
+    response.headers["Retry-After"] = str(retry_after)
+    response.headers["X-RateLimit-Limit"] = str(e.limit)
+    response.headers["X-RateLimit-Remaining"] = "0"
+    response.headers["X-RateLimit-Reset"] = str(retry_after)
+    return response
@@ -0,0 +1,56 @@
+"""
+Lagring og kontroll av engangskoder i Redis.
+Kontroll og forbruk av koden skjer i ett Lua-skript, slik at to samtidige innlogginger ikke kan
+bruke samme kode, og en innlogging koster én rundtur mot Redis. Feilforsøk telles per kode, og
+koden slettes etter AUTH_CODE_MAX_ATTEMPTS feil.
+"""
+from config import Config
+from utils.redis import redis_client
+
+CODE_KEY = "auth_code:{email}"
+ATTEMPTS_KEY = "auth_code_attempts:{email}"
+CODE_TTL = 600  # Sekunder en engangskode er gyldig
+
+# Resultater fra verify_auth_code
+CODE_OK = 1
+CODE_MISSING = 0
+CODE_INVALID = -1
+CODE_LOCKED = -2
+
+# KEYS: kode, feilforsøk. ARGV: oppgitt kode, maks feilforsøk.
+_CHECK_AND_CONSUME = redis_client.register_script("""
+local stored = redis.call('GET', KEYS[1])
+if not stored then
+    return 0
+end
+if stored == ARGV[1] then
+    redis.call('DEL', KEYS[1], KEYS[2])
+    return 1
+end
+local attempts = redis.call('INCR', KEYS[2])
+if attempts == 1 then
+    local ttl = redis.call('PTTL', KEYS[1])
+    if ttl > 0 then
+        redis.call('PEXPIRE', KEYS[2], ttl)
+    end
+end
+if attempts >= tonumber(ARGV[2]) then
+    redis.call('DEL', KEYS[1], KEYS[2])
+    return -2
+end
+return -1
+""")
+
+
+def store_auth_code(email, code, pipe):
+    """Lagrer ny engangskode og nullstiller feilforsøk. Kommandoene legges i pipe uten å kjøres."""
+    pipe.setex(CODE_KEY.format(email=email), CODE_TTL, code)
+    pipe.delete(ATTEMPTS_KEY.format(email=email))
+
+
+def verify_auth_code(email, code):
+    """Kontrollerer og forbruker koden atomisk. Returnerer CODE_OK, CODE_MISSING, CODE_INVALID eller CODE_LOCKED."""
+    return _CHECK_AND_CONSUME(
+        keys=[CODE_KEY.format(email=email), ATTEMPTS_KEY.format(email=email)],
+        args=[code, Config.AUTH_CODE_MAX_ATTEMPTS],
+    )
@@ -1,15 +1,225 @@
 """
-Rate limiting-oppsett for autentiseringsendepunkter.
-Bruker Redis som backend for å støtte distribuerte miljøer og flere prosesser.
+Distribuert rate limiting for alle endepunkter.
+Innloggede brukere begrenses per e-postadresse (session["user_email"]), slik at teknikere bak samme
+NAT ikke deler kvote. Autentiseringsendepunktene begrenses både per IP og per oppgitt e-postadresse.
+Grensene håndheves med GCRA (token bucket) i Redis: alle grenser for en forespørsel, f.eks.
+"5 per minute;20 per hour" for både IP og e-post, sjekkes og oppdateres i ett Lua-kall. Når Redis
+har avvist en klient, husker workeren det til kvoten er tilbake og avviser uten å gå mot Redis.
+Gjenstående kvote sendes i X-RateLimit-headere, og Retry-After settes når kvoten er brukt opp. Forbindelsespoolen deles med utils/redis.py.
 """
+import functools
+import logging
+import math
+import re
+import threading
+import time
+
+import redis
+from flask import g, request, session
+from werkzeug.exceptions import TooManyRequests
 
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
 from config import Config
 from utils.redis import redis_client
 
-# Initialiserer Flask-Limiter med Redis-backend
-limiter = Limiter(
-    get_remote_address,
-    storage_uri=Config.REDIS_URL
-)
+logger = logging.getLogger(__name__)
+
+KEY = "ratelimit:{scope}:{identity}:{count}/{period}"
+LOCAL_MAX_ENTRIES = 10000  # Maks avviste klienter workeren husker lokalt
+
+_PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+_LIMIT_PATTERN = re.compile(r"^\s*(\d+)\s*(?:per|/)\s*(second|minute|hour|day)s?\s*$")
+
+# GCRA for flere grenser i ett kall. KEYS: én per (identitet, grense).
+# ARGV: nå (ms), deretter periode (ms) og antall for hver nøkkel.
+# Returnerer {tillatt, gjenstående, ms til full kvote (tillatt) eller til neste forsøk (avvist),
+# grensen som gjenstående gjelder, nøkkelen som avviste eller må vente lengst, ms til neste forespørsel
+# slippes gjennom}.
+# Avviste forespørsler bruker ikke av kvoten.
+_GCRA = redis_client.register_script("""
+local now = tonumber(ARGV[1])
+local tats = {}
+local retry = 0
+local retry_limit = 0
+local retry_index = 0
+for i = 1, #KEYS do
+    local period = tonumber(ARGV[2 * i])
+    local count = tonumber(ARGV[2 * i + 1])
+    local tat = tonumber(redis.call('GET', KEYS[i]) or now)
+    if tat < now then
+        tat = now
+    end
+    local new_tat = tat + period / count
+    local allow_at = new_tat - period
+    if allow_at > now and allow_at - now > retry then
+        retry = allow_at - now
+        retry_limit = count
+        retry_index = i
+    end
+    tats[i] = new_tat
+end
+if retry > 0 then
+    return {0, 0, math.ceil(retry), retry_limit, retry_index, math.ceil(retry)}
+end
+local remaining, reset, limit, next_allowed, next_index = -1, 0, 0, 0, 0
+for i = 1, #KEYS do
+    local period = tonumber(ARGV[2 * i])
+    local count = tonumber(ARGV[2 * i + 1])
+    local ttl = tats[i] - now
+    redis.call('SET', KEYS[i], tostring(tats[i]), 'PX', math.ceil(ttl))
+    local left = math.floor((period - ttl) / (period / count))
+    if remaining < 0 or left < remaining then
+        remaining, reset, limit = left, math.ceil(ttl), count
+    end
+    if ttl + period / count - period > next_allowed then
+        next_allowed = ttl + period / count - period
+        next_index = i
+    end
+end
+return {1, remaining, reset, limit, next_index, math.ceil(next_allowed)}
+""")
+
+
+class RateLimitExceeded(TooManyRequests):
+    """Forespørselen er over grensen. retry_after er sekunder til neste forespørsel kan slippes gjennom."""
+
+    def __init__(self, retry_after, limit):
+        super().__init__(f"Grensen på {limit} forespørsler er nådd. Prøv igjen om {retry_after} sekunder.")
+        self.retry_after = retry_after
+        self.limit = limit
+
+
+def parse_limits(limit_value):
+    """Tolker f.eks. "5 per minute;20 per hour" til [(5, 60), (20, 3600)]. Kaster ValueError ved ugyldig format."""
+    limits = []
+    for part in limit_value.split(";"):
+        match = _LIMIT_PATTERN.match(part)
+        if not match:
+            raise ValueError(f"Ugyldig rate limit: {part!r}")
+        limits.append((int(match.group(1)), _PERIODS[match.group(2)]))
+    return limits
+
+
+def get_remote_address():
+    """Klientens IP-adresse."""
+    return request.remote_addr or "127.0.0.1"
+
+
+def user_or_ip():
+    """Innlogget bruker (e-post) eller IP-adresse for anonyme forespørsler."""
+    if session.get("logged_in") and session.get("user_email"):
+        return f"user:{session['user_email'].lower()}"
+    return f"ip:{get_remote_address()}"
+
+
+def ip_and_email():
+    """Autentiseringsendepunkter: egen kvote per IP og per oppgitt e-postadresse (body eller query)."""
+    data = request.get_json(silent=True) if request.is_json else None
+    email = (data or {}).get("email") if isinstance(data, dict) else None
+    email = (email or request.args.get("email") or "").strip().lower()
+    identities = [f"ip:{get_remote_address()}"]
+    if email:
+        identities.append(f"email:{email}")
+    return identities
+
+
+class Limiter:
+    """Rate limiter med samme decorator-API som Flask-Limiter (limit og shared_limit)."""
+
+    def __init__(self, key_func=user_or_ip):
+        self.key_func = key_func
+        self._blocked = {}  # (scope, identitet) -> (monotonic-tid kvoten er tilbake, grense)
+        self._blocked_lock = threading.Lock()
+
+    def init_app(self, app):
+        """Legger X-RateLimit-headere på svar fra begrensede endepunkter."""
+        app.after_request(self._add_headers)
+
+    def limit(self, limit_value, key_func=None, scope=None):
+        """Decorator som begrenser endepunktet. Uten scope får hvert endepunkt egen kvote.
+        key_func returnerer én identitet eller en liste; hver identitet får egen kvote for alle grensene.
+        """
+        limits = parse_limits(limit_value)
+
+        def decorator(fn):
+            name = scope or f"{fn.__module__}.{fn.__name__}"
+
+            @functools.wraps(fn)
+            def wrapped(*args, **kwargs):
+                self.hit(name, limits, key_func or self.key_func)
+                return fn(*args, **kwargs)
+            return wrapped
+        return decorator
+
+    def shared_limit(self, limit_value, scope, key_func=None):
+        """Som limit, men alle endepunkter med samme scope deler kvote."""
+        return self.limit(limit_value, key_func=key_func, scope=scope)
+
+    def hit(self, scope, limits, key_func):
+        """Teller forespørselen og kaster RateLimitExceeded hvis en grense er nådd."""
+        if not Config.RATELIMIT_ENABLED:
+            return
+        identities = key_func()
+        if isinstance(identities, str):
+            identities = [identities]
+        self._check_local(scope, identities)
+        keys = []
+        owners = []
+        args = [int(time.time() * 1000)]
+        for identity in identities:
+            for count, period in limits:
+                keys.append(KEY.format(scope=scope, identity=identity, count=count, period=period))
+                owners.append(identity)
+                args.extend([period * 1000, count])
+        try:
+            allowed, remaining, reset_ms, limit, index, next_ms = _GCRA(keys=keys, args=args)
+        except redis.RedisError as e:
+            # Redis nede: slipp forespørselen gjennom i stedet for å stoppe appen
+            logger.warning(f"Rate limiting utilgjengelig: {e}")
+            return
+        if not allowed:
+            self._block(scope, owners[index - 1], reset_ms / 1000, limit)
+            raise RateLimitExceeded(max(math.ceil(reset_ms / 1000), 1), limit)
+        if next_ms > 0:
+            # Kvoten er brukt opp: neste forespørsel før next_ms ville blitt avvist av Redis
+            self._block(scope, owners[index - 1], next_ms / 1000, limit)
+        g.rate_limit = (limit, remaining, max(math.ceil(reset_ms / 1000), 1), math.ceil(next_ms / 1000))
+
+    def _check_local(self, scope, identities):
+        """Avviser uten Redis-kall hvis en av identitetene nylig ble avvist og kvoten ikke er tilbake."""
+        now = time.monotonic()
+        for identity in identities:
+            entry = self._blocked.get((scope, identity))
+            if entry is None:
+                continue
+            until, limit = entry
+            if until > now:
+                raise RateLimitExceeded(max(math.ceil(until - now), 1), limit)
+            self._blocked.pop((scope, identity), None)
+
+    def _block(self, scope, identity, retry_after, limit):
+        """Husker avvisningen av identiteten lokalt til kvoten er tilbake."""
+        until = time.monotonic() + retry_after
+        with self._blocked_lock:
+            if len(self._blocked) >= LOCAL_MAX_ENTRIES:
+                now = time.monotonic()
+                for key in [k for k, (u, _) in self._blocked.items() if u <= now]:
+                    del self._blocked[key]
+                if len(self._blocked) >= LOCAL_MAX_ENTRIES:
+                    self._blocked.clear()
+            self._blocked[(scope, identity)] = (until, limit)
+
+    @staticmethod
+    def _add_headers(response):
+        info = g.pop("rate_limit", None)
+        if info is not None:
+            limit, remaining, reset, retry_after = info
+            response.headers["X-RateLimit-Limit"] = str(limit)
+            response.headers["X-RateLimit-Remaining"] = str(max(remaining, 0))
+            response.headers["X-RateLimit-Reset"] = str(reset)
+            if retry_after > 0:
+                # Kvoten er brukt opp: sekunder til neste forespørsel slippes gjennom
+                response.headers["Retry-After"] = str(retry_after)
+        return response
+
+
+limiter = Limiter()
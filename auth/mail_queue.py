@@ -0,0 +1,64 @@
+"""
+Kø for utsending av engangskoder.
+Web-prosessen legger e-poster i en Redis-liste og svarer umiddelbart; selve SMTP-utsendingen
+gjøres av auth/mail_worker.py. Leveringsstatus lagres per e-postadresse slik at den kan spørres opp.
+"""
+import json
+import time
+
+from utils.redis import redis_client
+from .codes import CODE_TTL
+
+QUEUE_KEY = "mail:queue"
+RETRY_KEY = "mail:retry"
+PROCESSING_KEY = "mail:processing:{worker}"  # Jobber en worker har tatt, men ikke fullført
+HEARTBEAT_KEY = "mail:worker:{worker}"  # Finnes så lenge workeren lever
+STATUS_KEY = "mail:status:{email}"
+STATUS_TTL = CODE_TTL  # Samme levetid som engangskoden
+
+STATUS_QUEUED = "queued"
+STATUS_SENT = "sent"
+STATUS_RETRYING = "retrying"
+STATUS_FAILED = "failed"
+
+
+def _status_key(email):
+    """Redis-nøkkel for leveringsstatus til en e-postadresse."""
+    return STATUS_KEY.format(email=email.lower())
+
+
+def set_status(email, status, attempts=0, error=None, pipe=None):
+    """Lagrer leveringsstatus for en e-postadresse."""
+    target = pipe if pipe is not None else redis_client.pipeline()
+    key = _status_key(email)
+    target.hset(key, mapping={
+        "status": status,
+        "attempts": attempts,
+        "error": error or "",
+        "updated_at": int(time.time()),
+    })
+    target.expire(key, STATUS_TTL)
+    if pipe is None:
+        target.execute()
+
+
+def enqueue_auth_code(email, code, pipe=None):
+    """Legger engangskode i utsendingskøen. Sendes pipe inn, legges kommandoene i den uten å kjøres."""
+    job = json.dumps({"email": email, "code": code, "attempts": 0, "queued_at": time.time()})
+    target = pipe if pipe is not None else redis_client.pipeline()
+    target.lpush(QUEUE_KEY, job)
+    set_status(email, STATUS_QUEUED, pipe=target)
+    if pipe is None:
+        target.execute()
+
+
+def get_delivery_status(email):
+    """Returnerer leveringsstatus for e-postadressen, eller None hvis ingen kode er forespurt nylig."""
+    data = redis_client.hgetall(_status_key(email))
+    if not data:
+        return None
+    return {
+        "status": data.get("status"),
+        "attempts": int(data.get("attempts", 0)),
+        "updated_at": int(data.get("updated_at", 0)),
+    }
@@ -0,0 +1,208 @@
+"""
+Bakgrunnsprosess for utsending av engangskoder.
+Leser jobber fra Redis-køen i auth/mail_queue.py, sender dem i batcher over en vedvarende
+SMTP-forbindelse og prøver feilede utsendinger på nytt med eksponentiell backoff.
+Jobber flyttes atomisk (BLMOVE) fra køen til workerens egen prosesseringsliste og fjernes derfra først
+når de er sendt eller planlagt på nytt. Hver worker holder en heartbeat-nøkkel i live, og
+prosesseringslister uten heartbeat (workeren stoppet, f.eks. med et annet vertsnavn etter redeploy)
+legges tilbake i køen ved oppstart og deretter jevnlig, i tillegg til workerens egen liste ved oppstart. Før hvert forsøk kontrolleres det at koden fortsatt er gyldig og ikke er erstattet av en
+nyere kode; ellers forkastes jobben.
+Kjøres under supervisord: python -m auth.mail_worker
+"""
+import json
+import logging
+import smtplib
+import socket
+import time
+
+import redis
+
+from config import Config
+from utils import metrics
+from utils.redis import redis_client
+from .codes import CODE_KEY
+from .mail_queue import (
+    HEARTBEAT_KEY, PROCESSING_KEY, QUEUE_KEY, RETRY_KEY, STATUS_SENT, STATUS_RETRYING, STATUS_FAILED, set_status,
+)
+from .utils import build_auth_code_message
+
+logger = logging.getLogger("mail_worker")
+
+# Navn per vert, slik at prosesseringslisten finnes igjen når supervisord starter workeren på nytt.
+# Lister fra verter som er borte, hentes inn av requeue_processing når heartbeaten deres er utløpt.
+WORKER = socket.gethostname()
+PROCESSING = PROCESSING_KEY.format(worker=WORKER)
+HEARTBEAT = HEARTBEAT_KEY.format(worker=WORKER)
+# Heartbeaten fornyes før hver utsending, og én utsending kan ta opptil to SMTP-timeouts (med ny tilkobling)
+HEARTBEAT_TTL = int(Config.SMTP_TIMEOUT * 3) + 30
+
+# Flytter forfalte retry-jobber tilbake til køen atomisk
+_PROMOTE_DUE = redis_client.register_script("""
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, job in ipairs(due) do
+    redis.call('ZREM', KEYS[1], job)
+    redis.call('RPUSH', KEYS[2], job)
+end
+return #due
+""")
+
+
+class SMTPConnection:
+    """Vedvarende SMTP-forbindelse som kobles opp ved behov og lukkes etter inaktivitet."""
+
+    def __init__(self):
+        self._server = None
+        self._last_used = 0.0
+
+    def _connect(self):
+        self._server = smtplib.SMTP(Config.SMTP_SERVER, Config.SMTP_PORT, timeout=Config.SMTP_TIMEOUT)
+
+    def close(self):
+        """Lukker forbindelsen hvis den er åpen."""
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self._server = None
+
+    def close_if_idle(self):
+        """Lukker forbindelsen dersom den ikke er brukt på MAIL_SMTP_IDLE_TIMEOUT sekunder."""
+        if self._server is not None and time.time() - self._last_used > Config.MAIL_SMTP_IDLE_TIMEOUT:
+            self.close()
+
+    def send(self, msg):
+        """Sender én melding. Kobler til på nytt én gang hvis serveren har lukket forbindelsen."""
+        if self._server is None:
+            self._connect()
+        try:
+            self._server.send_message(msg)
+        except (smtplib.SMTPServerDisconnected, OSError):
+            self.close()
+            self._connect()
+            self._server.send_message(msg)
+        self._last_used = time.time()
+
+
+def _next_batch():
+    """Venter på neste jobb og henter deretter opptil MAIL_BATCH_SIZE jobber uten å blokkere.
+    Jobbene flyttes til prosesseringslisten, så de ikke går tapt om workeren stopper under utsending.
+    """
+    item = redis_client.blmove(QUEUE_KEY, PROCESSING, 1, "RIGHT", "LEFT")
+    if item is None:
+        return []
+    batch = [item]
+    if Config.MAIL_BATCH_SIZE > 1:
+        pipe = redis_client.pipeline(transaction=False)
+        for _ in range(Config.MAIL_BATCH_SIZE - 1):
+            pipe.lmove(QUEUE_KEY, PROCESSING, "RIGHT", "LEFT")
+        batch.extend(raw for raw in pipe.execute() if raw is not None)
+    return batch
+
+
+def _heartbeat():
+    """Markerer at workeren lever, slik at andre workere ikke henter inn prosesseringslisten."""
+    redis_client.set(HEARTBEAT, int(time.time()), ex=HEARTBEAT_TTL)
+
+
+def requeue_processing(own=False):
+    """Legger jobber fra prosesseringslister til workere uten heartbeat tilbake først i køen.
+    Med own=True tas også workerens egen liste (ved oppstart, før noe er hentet fra køen).
+    """
+    prefix = PROCESSING_KEY.format(worker="")
+    moved = 0
+    for key in redis_client.scan_iter(match=prefix + "*", count=100):
+        if key == PROCESSING:
+            if not own:
+                continue
+        elif redis_client.exists(HEARTBEAT_KEY.format(worker=key[len(prefix):])):
+            continue
+        while redis_client.lmove(key, QUEUE_KEY, "LEFT", "RIGHT") is not None:
+            moved += 1
+    if moved:
+        logger.warning(f"{moved} e-postjobber som ikke ble fullført er lagt tilbake i køen.")
+    return moved
+
+
+def _done(raw, pipe=None):
+    """Fjerner en fullført jobb fra prosesseringslisten."""
+    (pipe if pipe is not None else redis_client).lrem(PROCESSING, 1, raw)
+
+
+def _code_is_current(job):
+    """True hvis jobbens kode fortsatt er gyldig og ikke er erstattet av en nyere kode."""
+    return redis_client.get(CODE_KEY.format(email=job["email"])) == job["code"]
+
+
+def _handle_failure(raw, job, error):
+    """Planlegger nytt forsøk med backoff, eller markerer utsendingen som feilet."""
+    job["attempts"] += 1
+    pipe = redis_client.pipeline()
+    if job["attempts"] >= Config.MAIL_MAX_ATTEMPTS:
+        logger.error(f"Ga opp utsending til {job['email']} etter {job['attempts']} forsøk: {error}")
+        set_status(job["email"], STATUS_FAILED, job["attempts"], str(error), pipe=pipe)
+    else:
+        delay = Config.MAIL_RETRY_BACKOFF * (2 ** (job["attempts"] - 1))
+        pipe.zadd(RETRY_KEY, {json.dumps(job): time.time() + delay})
+        set_status(job["email"], STATUS_RETRYING, job["attempts"], str(error), pipe=pipe)
+    _done(raw, pipe)
+    pipe.execute()
+
+
+def process_batch(connection, batch):
+    """Sender alle jobber i batchen over samme SMTP-forbindelse."""
+    for raw in batch:
+        try:
+            job = json.loads(raw)
+        except ValueError:
+            logger.error("Ugyldig jobb i e-postkøen ble forkastet.")
+            _done(raw)
+            continue
+        if not _code_is_current(job):
+            # Koden er utløpt, brukt eller erstattet av en nyere forespørsel
+            logger.info(f"Forkastet utsending til {job['email']}: koden er ikke lenger gyldig.")
+            _done(raw)
+            continue
+        _heartbeat()
+        started = time.perf_counter()
+        try:
+            connection.send(build_auth_code_message(job["email"], job["code"]))
+        except (smtplib.SMTPException, OSError) as e:
+            metrics.SMTP_SEND_DURATION.labels("failure").observe(time.perf_counter() - started)
+            logger.warning(f"Kunne ikke sende e-post til {job['email']}: {e}")
+            connection.close()
+            _handle_failure(raw, job, e)
+            continue
+        metrics.SMTP_SEND_DURATION.labels("success").observe(time.perf_counter() - started)
+        pipe = redis_client.pipeline()
+        set_status(job["email"], STATUS_SENT, job["attempts"] + 1, pipe=pipe)
+        _done(raw, pipe)
+        pipe.execute()
+
+
+def run():
+    """Hovedløkke for e-postutsending."""
+    connection = SMTPConnection()
+    logger.info("E-postutsending startet.")
+    swept_at = None
+    while True:
+        try:
+            _heartbeat()
+            if swept_at is None or time.monotonic() - swept_at >= HEARTBEAT_TTL:
+                requeue_processing(own=swept_at is None)
+                swept_at = time.monotonic()
+            _PROMOTE_DUE(keys=[RETRY_KEY, QUEUE_KEY], args=[time.time(), Config.MAIL_BATCH_SIZE])
+            batch = _next_batch()
+            if batch:
+                process_batch(connection, batch)
+            else:
+                connection.close_if_idle()
+        except redis.RedisError as e:
+            logger.error(f"Redis-feil i e-postutsending: {e}")
+            time.sleep(1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    run()
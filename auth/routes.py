@@ -1,35 +1,54 @@
 """
 Blueprint for autentiseringsruter (login, kode, logout).
-Håndterer innlogging med engangskode, utlogging og rate limiting.
+Håndterer innlogging med engangskode, utlogging og rate limiting (per IP og per e-postadresse).
+Engangskoder legges i en utsendingskø og sendes av auth/mail_worker.py, og kontrolleres atomisk i auth/codes.py.
+Leveringsstatus kan bare hentes for e-postadressen klienten selv ba om kode til (lagret i sesjonen).
 """
+import redis
 from flask import Blueprint, request, jsonify, session, current_app as app
-from .utils import send_auth_code, generate_auth_code, is_email_approved
-from .limiter import limiter
+from .utils import generate_auth_code, is_email_approved
+from .limiter import ip_and_email, limiter
+from .codes import CODE_MISSING, CODE_LOCKED, CODE_OK, store_auth_code, verify_auth_code
+from .mail_queue import enqueue_auth_code, get_delivery_status
 from utils.redis import redis_client
-from clearpass.roles import load_approved_domains_and_emails
 
 bp = Blueprint('auth', __name__)
 
 @bp.route('/request_auth_code', methods=['POST'])
-@limiter.limit("5 per minute;20 per hour")
+@limiter.limit("5 per minute;20 per hour", key_func=ip_and_email)
 def request_auth_code():
     """API-endepunkt for å be om engangskode til e-post. Sjekker at e-post er godkjent og sender kode."""
     data = request.get_json()
     email = data.get("email", "").strip() if data else ""
     if not email:
         return jsonify({"error": "E-postadresse er påkrevd."}), 400
-    approved_domains, approved_emails = load_approved_domains_and_emails()
-    if not is_email_approved(email, approved_domains, approved_emails):
+    if not is_email_approved(email):
         return jsonify({"error": "E-postadresse eller domene er ikke godkjent."}), 403
     code = generate_auth_code()
-    redis_client.setex(f"auth_code:{email}", 600, code)
-    if send_auth_code(email, code):
-        return jsonify({"message": "Autentiseringskode sendt."}), 200
-    else:
+    try:
+        pipe = redis_client.pipeline()
+        store_auth_code(email, code, pipe)
+        enqueue_auth_code(email, code, pipe)
+        pipe.execute()
+    except redis.RedisError as e:
+        app.logger.error(f"Kunne ikke legge engangskode i kø: {e}")
         return jsonify({"error": "Kunne ikke sende autentiseringskode."}), 500
+    # Knytter leveringsstatusen til klienten, så /auth_code_status ikke kan spørres for vilkårlige adresser
+    session["auth_code_email"] = email
+    return jsonify({"message": "Autentiseringskode sendt."}), 200
+
+@bp.route('/auth_code_status', methods=['GET'])
+@limiter.limit("30 per minute", key_func=ip_and_email)
+def auth_code_status():
+    """API-endepunkt for å sjekke leveringsstatus for engangskoden klienten sist ba om."""
+    email = session.get("auth_code_email")
+    status = get_delivery_status(email) if email else None
+    if status is None:
+        return jsonify({"error": "Ingen kode er forespurt nylig."}), 404
+    return jsonify(status), 200
 
 @bp.route('/login', methods=['POST'])
-@limiter.limit("10 per minute;30 per hour")
+@limiter.limit("10 per minute;30 per hour", key_func=ip_and_email)
 def login():
     """API-endepunkt for å logge inn med e-post og engangskode. Oppretter sesjon ved suksess."""
     data = request.get_json()
@@ -37,12 +56,18 @@ def login():
     code = data.get("code", "").strip() if data else ""
     if not email or not code:
         return jsonify({"error": "E-postadresse og kode er påkrevd."}), 400
-    stored_code = redis_client.get(f"auth_code:{email}")
-    if not stored_code:
+    try:
+        result = verify_auth_code(email, code)
+    except redis.RedisError as e:
+        app.logger.error(f"Kunne ikke kontrollere engangskode: {e}")
+        return jsonify({"error": "Kunne ikke logge inn. Prøv igjen."}), 500
+    if result == CODE_MISSING:
         return jsonify({"error": "Ingen kode er forespurt for denne e-postadressen."}), 400
-    if code != stored_code:
+    if result == CODE_LOCKED:
+        return jsonify({"error": "For mange feilforsøk. Be om en ny kode."}), 401
+    if result != CODE_OK:
         return jsonify({"error": "Ugyldig kode."}), 401
-    redis_client.delete(f"auth_code:{email}")
+    session.pop("auth_code_email", None)
     session.permanent = True
     session["logged_in"] = True
     session["user_email"] = email
@@ -1,20 +1,20 @@
 """
 Autentiseringsverktøy for CP-Tekniker Device Management App.
-Inneholder funksjoner for å generere og sende engangskoder, samt sjekke om e-post er godkjent.
+Inneholder funksjoner for å generere engangskoder og bygge e-posten som sendes, samt sjekke om e-post er godkjent.
 """
 import random
-import re
-import smtplib
-from email.message import EmailMessage
-import email.utils
 from config import Config
+from clearpass.roles import approved_index
 
 def generate_auth_code():
     """Genererer en tilfeldig engangskode på formatet 123-456."""
     return f"{random.randint(100,999)}-{random.randint(100,999)}"
 
-def send_auth_code(recipient_email, code):
-    """Sender engangskode på e-post til bruker via SMTP."""
+def build_auth_code_message(recipient_email, code):
+    """Bygger e-posten med engangskode. Selve utsendingen gjøres av auth/mail_worker.py."""
+    # Importeres her: e-postbyggingen brukes kun av e-postutsendingen, ikke av web-workerne
+    from email.message import EmailMessage
+    import email.utils
     from_name = Config.SMTP_FROM_NAME
     msg = EmailMessage()
     msg["Subject"] = "Din engangskode for innlogging til Aruba ClearPass"
@@ -49,21 +49,8 @@ NorgesGruppen Data AS
 """
     msg.set_content(text_part, subtype="plain", charset="utf-8")
     msg.add_alternative(html_part, subtype="html", charset="utf-8")
-    try:
-        with smtplib.SMTP(Config.SMTP_SERVER, Config.SMTP_PORT) as server:
-            server.send_message(msg)
-        return True
-    except Exception as e:
-        print(f"Kunne ikke sende e-post: {e}")
-        return False
+    return msg
 
-def is_email_approved(email, approved_domains, approved_emails):
+def is_email_approved(email):
     """Sjekker om e-post er godkjent basert på eksakt match eller domenematch."""
-    email = email.lower()
-    if email in approved_emails:
-        return True
-    match = re.match(r"^[^@]+@([^@]+)$", email)
-    if not match:
-        return False
-    domain = match.group(1)
-    return domain in approved_domains
+    return approved_index.is_approved(email)
@@ -0,0 +1,191 @@
+"""
+Lokal stand-in for ClearPass API-et, brukt av benchmarken.
+Implementerer /api/oauth, /api/device, /api/device/mac/{mac} og /api/role-mapping/name/...
+med enheter i minnet, konfigurerbar forsinkelse og injisering av feil (503).
+Teller alle kall per operasjon og status slik at rapporten kan vise hvor mange kall appen gjør oppstrøms.
+"""
+import json
+import random
+import secrets
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+# Rollene fake ClearPass returnerer i role-mapping ([Guest Roles])
+ROLES = [
+    {"role_id": 9901, "role_name": "STORE-VLAN1"},
+    {"role_id": 9902, "role_name": "STORE-VLAN60"},
+    {"role_id": 9903, "role_name": "STORE-VLAN151 Kundenett"},
+]
+
+
+class FakeClearPass:
+    """Fake ClearPass-server i en egen tråd.
+
+    latency/jitter: sekunder forsinkelse per kall (latency + tilfeldig 0..jitter).
+    error_rate: andel kall (0-1) som svarer 503 i stedet for å utføres.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, error_rate=0.0, token_ttl=3600):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.token_ttl = token_ttl
+        self.devices = {}
+        self.tokens = set()
+        self.calls = Counter()
+        self._lock = threading.RLock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def seed(self, count, prefix="02-be-0c"):
+        """Legger inn count eksisterende enheter og returnerer MAC-adressene deres."""
+        macs = []
+        for i in range(count):
+            mac = f"{prefix}-{(i >> 16) & 0xff:02x}-{(i >> 8) & 0xff:02x}-{i & 0xff:02x}"
+            self.devices[mac] = {"id": i + 1, "mac": mac, "role_id": ROLES[0]["role_id"], "visitor_name": f"Bench {i}"}
+            macs.append(mac)
+        return macs
+
+    def call_counts(self):
+        """Kall per operasjon og status, f.eks. {"device_get": {"200": 10, "404": 1}}."""
+        with self._lock:
+            result = {}
+            for (operation, status), count in self.calls.items():
+                result.setdefault(operation, {})[str(status)] = count
+            return result
+
+    def _record(self, operation, status):
+        with self._lock:
+            self.calls[(operation, status)] += 1
+
+    def _delay(self):
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                return self.rfile.read(length) if length else b""
+
+            def _send(self, operation, status, body=None):
+                fake._record(operation, status)
+                payload = json.dumps(body if body is not None else {}).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _route(self, method):
+                parts = urlsplit(self.path)
+                path = unquote(parts.path)
+                body = self._body()
+                if path == "/api/oauth" and method == "POST":
+                    operation = "token"
+                elif path.startswith("/api/device"):
+                    operation = f"device_{method.lower()}"
+                elif path.startswith("/api/role-mapping/name/") and method == "GET":
+                    operation = "role_mapping"
+                else:
+                    return self._send("unknown", 404, {"detail": "Ukjent endepunkt"})
+
+                fake._delay()
+                if fake.error_rate and random.random() < fake.error_rate:
+                    return self._send(operation, 503, {"detail": "Injisert feil"})
+
+                if operation == "token":
+                    token = secrets.token_hex(16)
+                    with fake._lock:
+                        fake.tokens.add(token)
+                    return self._send(operation, 200, {"access_token": token, "expires_in": fake.token_ttl})
+
+                auth = self.headers.get("Authorization", "")
+                if auth.removeprefix("Bearer ") not in fake.tokens:
+                    return self._send(operation, 401, {"detail": "Ugyldig token"})
+
+                if operation == "role_mapping":
+                    rules = [{"role_name": r["role_name"], "role_id": r["role_id"]} for r in ROLES]
+                    return self._send(operation, 200, {"rules": rules})
+                if path == "/api/device" and method == "GET":
+                    return self._list_devices(operation, parse_qs(parts.query))
+                if path == "/api/device" and method == "POST":
+                    return self._create_device(operation, body)
+                if path.startswith("/api/device/mac/"):
+                    mac = path.rsplit("/", 1)[1].lower()
+                    if method == "GET":
+                        device = fake.devices.get(mac)
+                        if device is None:
+                            return self._send(operation, 404, {"detail": "Ikke funnet"})
+                        return self._send(operation, 200, device)
+                    if method == "PATCH":
+                        return self._update_device(operation, mac, body)
+                return self._send(operation, 405, {"detail": "Metode ikke støttet"})
+
+            def _list_devices(self, operation, query):
+                offset = int(query.get("offset", ["0"])[0])
+                limit = int(query.get("limit", ["25"])[0])
+                after_id = json.loads(query.get("filter", ["{}"])[0]).get("id", {}).get("$gt")
+                with fake._lock:
+                    items = sorted(fake.devices.values(), key=lambda d: d["id"])
+                if after_id is not None:
+                    items = [d for d in items if d["id"] > after_id]
+                page = items[offset:offset + limit]
+                return self._send(operation, 200, {"_embedded": {"items": page}, "count": len(items)})
+
+            def _create_device(self, operation, body):
+                data = json.loads(body or b"{}")
+                mac = str(data.get("mac", "")).lower()
+                with fake._lock:
+                    if not mac or mac in fake.devices:
+                        return self._send(operation, 422, {"detail": "Enheten finnes allerede"})
+                    device = dict(data, id=len(fake.devices) + 1, mac=mac)
+                    fake.devices[mac] = device
+                return self._send(operation, 201, device)
+
+            def _update_device(self, operation, mac, body):
+                data = json.loads(body or b"{}")
+                with fake._lock:
+                    device = fake.devices.get(mac)
+                    if device is None:
+                        return self._send(operation, 404, {"detail": "Ikke funnet"})
+                    device.update(data)
+                    device = dict(device)
+                return self._send(operation, 200, device)
+
+            def do_GET(self):
+                self._route("GET")
+
+            def do_POST(self):
+                self._route("POST")
+
+            def do_PATCH(self):
+                self._route("PATCH")
+
+        return Handler
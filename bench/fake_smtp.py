@@ -0,0 +1,113 @@
+"""
+Minimal SMTP-mottaker for benchmarken.
+Tar imot e-post fra auth/mail_worker.py, trekker ut engangskoden og lar benchmarken vente på
+koden for en gitt mottaker. Støtter kun det SMTP-utsendingen i appen bruker (uten TLS og innlogging).
+"""
+import email
+import re
+import socketserver
+import threading
+import time
+
+CODE_PATTERN = re.compile(r"\b(\d{3}-\d{3})\b")
+
+
+class FakeSMTP:
+    """SMTP-sink i en egen tråd. Mottatte koder lagres per mottaker."""
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.codes = {}
+        self.received = 0
+        self._cond = threading.Condition()
+        self._server = socketserver.ThreadingTCPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def wait_for_code(self, recipient, timeout=30):
+        """Venter på neste engangskode til mottakeren. Returnerer koden, eller None ved timeout."""
+        deadline = time.monotonic() + timeout
+        recipient = recipient.lower()
+        with self._cond:
+            while recipient not in self.codes:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            return self.codes.pop(recipient)
+
+    def _deliver(self, recipients, data):
+        msg = email.message_from_bytes(data)
+        code = None
+        for part in msg.walk():
+            if part.get_content_type() == "text/plain":
+                match = CODE_PATTERN.search(part.get_payload(decode=True).decode("utf-8", "replace"))
+                if match:
+                    code = match.group(1)
+                    break
+        with self._cond:
+            self.received += 1
+            if code:
+                for rcpt in recipients:
+                    self.codes[rcpt.lower()] = code
+            self._cond.notify_all()
+
+    def _handler_class(self):
+        sink = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def _reply(self, line):
+                self.wfile.write(f"{line}\r\n".encode())
+
+            def handle(self):
+                self._reply("220 bench-smtp ESMTP")
+                recipients = []
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line.decode("utf-8", "replace").strip()
+                    verb = command[:4].upper()
+                    if verb == "EHLO":
+                        self._reply("250-bench-smtp")
+                        self._reply("250 8BITMIME")
+                    elif verb == "HELO":
+                        self._reply("250 bench-smtp")
+                    elif verb == "MAIL":
+                        recipients = []
+                        self._reply("250 OK")
+                    elif verb == "RCPT":
+                        match = re.search(r"<([^>]*)>", command)
+                        recipients.append(match.group(1) if match else command[8:].strip())
+                        self._reply("250 OK")
+                    elif verb == "DATA":
+                        self._reply("354 Slutt med <CRLF>.<CRLF>")
+                        lines = []
+                        while True:
+                            data_line = self.rfile.readline()
+                            if not data_line or data_line in (b".\r\n", b".\n"):
+                                break
+                            # Fjern dot-stuffing
+                            lines.append(data_line[1:] if data_line.startswith(b"..") else data_line)
+                        sink._deliver(recipients, b"".join(lines))
+                        self._reply("250 OK")
+                    elif verb in ("RSET", "NOOP"):
+                        recipients = [] if verb == "RSET" else recipients
+                        self._reply("250 OK")
+                    elif verb == "QUIT":
+                        self._reply("221 Bye")
+                        return
+                    else:
+                        self._reply("502 Kommando ikke støttet")
+
+        return Handler
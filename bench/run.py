@@ -0,0 +1,330 @@
+"""
+Benchmark for CP-Tekniker Device Management App.
+
+Starter fake ClearPass og en SMTP-mottaker lokalt, starter appen med gunicorn (samme
+gunicorn.conf.py som i produksjon) og e-postutsendingen, og kjører realistiske
+tekniker-arbeidsflyter mot appen: innlogging med engangskode, rollehenting, oppslag,
+opprettelse og oppdatering av enheter. Resultatet (gjennomstrømning, p50/p95/p99 per steg
+og antall kall mot ClearPass) skrives som JSON slik at kjøringer kan sammenlignes.
+
+Krever en kjørende Redis. Databasen i --redis-url tømmes før kjøringen.
+
+    python -m bench.run --users 20 --iterations 10 --workers 4
+    python -m bench.run --compare bench/results/forrige.json
+"""
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import redis
+import requests
+
+from .fake_clearpass import ROLES, FakeClearPass
+from .fake_smtp import FakeSMTP
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, "bench", "results")
+BENCH_DOMAIN = "bench.example"
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank-persentil av en sortert liste."""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples, wall_time):
+    """Lager statistikk (antall, feil, rate og persentiler i ms) fra [(latency, ok), ...]."""
+    latencies = sorted(latency for latency, _ in samples)
+    errors = sum(1 for _, ok in samples if not ok)
+
+    def ms(value):
+        return round(value * 1000, 2) if value is not None else None
+
+    return {
+        "count": len(samples),
+        "errors": errors,
+        "throughput_rps": round(len(samples) / wall_time, 2) if wall_time else None,
+        "mean_ms": ms(sum(latencies) / len(latencies)) if latencies else None,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "max_ms": ms(latencies[-1]) if latencies else None,
+    }
+
+
+class Recorder:
+    """Samler målinger per steg fra alle teknikere (tråder)."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def record(self, step, latency, ok, detail=None):
+        with self._lock:
+            self.samples[step].append((latency, ok))
+            if not ok:
+                self.errors[step][str(detail)] += 1
+
+
+class Technician:
+    """Én virtuell tekniker med egen HTTP-sesjon (cookie) som kjører arbeidsflyten."""
+
+    def __init__(self, index, base_url, smtp, recorder, existing_macs, mail_timeout):
+        self.index = index
+        self.email = f"tekniker{index}@{BENCH_DOMAIN}"
+        self.base_url = base_url
+        self.smtp = smtp
+        self.recorder = recorder
+        self.existing_macs = existing_macs
+        self.mail_timeout = mail_timeout
+        self.http = requests.Session()
+        self.counter = 0
+
+    def _call(self, step, method, path, expected, **kwargs):
+        started = time.perf_counter()
+        try:
+            resp = self.http.request(method, f"{self.base_url}{path}", timeout=60, **kwargs)
+        except requests.RequestException as e:
+            self.recorder.record(step, time.perf_counter() - started, False, type(e).__name__)
+            return None
+        ok = resp.status_code in expected
+        self.recorder.record(step, time.perf_counter() - started, ok, resp.status_code)
+        return resp if ok else None
+
+    def login(self):
+        """Ber om engangskode, venter på e-posten og logger inn. Returnerer True ved suksess."""
+        started = time.perf_counter()
+        if self._call("request_auth_code", "POST", "/request_auth_code", {200}, json={"email": self.email}) is None:
+            return False
+        code = self.smtp.wait_for_code(self.email, timeout=self.mail_timeout)
+        self.recorder.record("mail_delivery", time.perf_counter() - started, code is not None, "timeout")
+        if code is None:
+            return False
+        return self._call("login", "POST", "/login", {200}, json={"email": self.email, "code": code}) is not None
+
+    def _new_mac(self):
+        self.counter += 1
+        return f"02-be-{self.index >> 8 & 0xff:02x}-{self.index & 0xff:02x}-{self.counter >> 8 & 0xff:02x}-{self.counter & 0xff:02x}"
+
+    def workflow(self):
+        """Én runde: hent roller, slå opp eksisterende enhet, opprett ny, oppdater den og slå den opp."""
+        self._call("get_device_roles", "GET", "/GetDeviceRoles", {200})
+        self._call("get_device_info", "GET", "/get_device_info", {200},
+                   params={"macaddr": random.choice(self.existing_macs)})
+        mac = self._new_mac()
+        payload = {
+            "mac": mac,
+            "role_id": ROLES[0]["role_id"],
+            "visitor_name": f"Bench {mac}",
+            "notes": "Opprettet av benchmark",
+        }
+        if self._call("create_device", "POST", "/create_device", {201}, json=payload) is None:
+            return
+        self._call("update_device", "PATCH", "/update_device", {200}, json={"mac": mac, "vid": "12345"})
+        self._call("get_device_info_after_update", "GET", "/get_device_info", {200}, params={"macaddr": mac})
+
+    def run(self, iterations, think_time):
+        if not self.login():
+            return
+        for _ in range(iterations):
+            self.workflow()
+            if think_time:
+                time.sleep(random.uniform(0, think_time))
+
+
+def _approved_domains_file(tmpdir):
+    """Godkjenner benchmark-domenet med alle fake-roller."""
+    path = os.path.join(tmpdir, "approved_domains.json")
+    with open(path, "w") as f:
+        json.dump([{"email": BENCH_DOMAIN, "roles": ROLES}], f)
+    return path
+
+
+def _wait_until_ready(url, process, timeout=30):
+    """Venter til appen svarer på / (eller feiler hvis prosessen avslutter)."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("gunicorn avsluttet under oppstart")
+        try:
+            requests.get(f"{url}/", timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"Appen svarte ikke innen {timeout} sekunder")
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline):
+    """Skriver en tabell med endring i gjennomstrømning og persentiler mot en tidligere rapport."""
+    print(f"\nSammenligning mot {baseline['meta'].get('started_at')} ({baseline['meta'].get('git_revision')}):")
+    print(f"{'steg':32} {'metrikk':16} {'før':>10} {'nå':>10} {'endring':>9}")
+    rows = [("totalt", report["summary"], baseline["summary"])]
+    rows += [(step, stats, baseline["steps"].get(step, {})) for step, stats in report["steps"].items()]
+    for step, now, before in rows:
+        for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms"):
+            old, new = before.get(key), now.get(key)
+            change = f"{(new - old) / old * 100:+.1f}%" if old and new is not None else "-"
+            print(f"{step:32} {key:16} {old if old is not None else '-':>10} {new if new is not None else '-':>10} {change:>9}")
+
+
+def run(args):
+    fake = FakeClearPass(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate).start()
+    smtp = FakeSMTP().start()
+    existing_macs = fake.seed(args.seed_devices)
+    redis.Redis.from_url(args.redis_url).flushdb()
+
+    with tempfile.TemporaryDirectory(prefix="cp-bench-") as tmpdir:
+        base_url = f"http://127.0.0.1:{args.port}"
+        env = dict(
+            os.environ,
+            BASE_URL=fake.url,
+            CLIENT_ID="bench",
+            CLIENT_SECRET="bench",
+            SMTP_SERVER="127.0.0.1",
+            SMTP_PORT=str(smtp.port),
+            SMTP_FROM="bench@localhost",
+            REDIS_URL=args.redis_url,
+            APPROVED_DOMAINS_FILE=_approved_domains_file(tmpdir),
+            RATELIMIT_ENABLED="true" if args.rate_limits else "false",
+            SERVING_MODE=args.serving_mode,
+            GUNICORN_BIND=f"127.0.0.1:{args.port}",
+            GUNICORN_WORKERS=str(args.workers),
+            GUNICORN_CERTFILE="",
+            GUNICORN_KEYFILE="",
+            GUNICORN_LOG_LEVEL="warning",
+            PROMETHEUS_MULTIPROC_DIR=os.path.join(tmpdir, "prometheus"),
+        )
+        log_path = os.path.join(tmpdir, "app.log")
+        with open(log_path, "w") as log:
+            app_proc = subprocess.Popen(
+                [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+                cwd=REPO_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+            )
+            mailer_proc = subprocess.Popen(
+                [sys.executable, "-m", "auth.mail_worker"],
+                cwd=REPO_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+            )
+            try:
+                _wait_until_ready(base_url, app_proc)
+                recorder = Recorder()
+                technicians = [
+                    Technician(i, base_url, smtp, recorder, existing_macs, args.mail_timeout)
+                    for i in range(args.users)
+                ]
+                threads = [
+                    threading.Thread(target=t.run, args=(args.iterations, args.think_time))
+                    for t in technicians
+                ]
+                started_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+                started = time.perf_counter()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                wall_time = time.perf_counter() - started
+            finally:
+                for proc in (app_proc, mailer_proc):
+                    proc.terminate()
+                for proc in (app_proc, mailer_proc):
+                    try:
+                        proc.wait(timeout=10)
+                    except subprocess.TimeoutExpired:
+                        proc.kill()
+        with open(log_path) as log:
+            app_log = log.read()
+
+    fake.stop()
+    smtp.stop()
+
+    all_samples = [s for step, samples in recorder.samples.items() if step != "mail_delivery" for s in samples]
+    report = {
+        "meta": {
+            "started_at": started_at,
+            "git_revision": _git_revision(),
+            "wall_time_s": round(wall_time, 3),
+            "users": args.users,
+            "iterations": args.iterations,
+            "workers": args.workers,
+            "serving_mode": args.serving_mode,
+            "upstream_latency_s": args.latency,
+            "upstream_jitter_s": args.jitter,
+            "upstream_error_rate": args.error_rate,
+            "rate_limits": args.rate_limits,
+        },
+        "summary": summarize(all_samples, wall_time),
+        "steps": {step: summarize(samples, wall_time) for step, samples in sorted(recorder.samples.items())},
+        "errors": {step: dict(details) for step, details in recorder.errors.items()},
+        "upstream_calls": fake.call_counts(),
+        "emails_received": smtp.received,
+    }
+    if any(report["errors"].values()) and app_log.strip():
+        report["app_log_tail"] = app_log.strip().splitlines()[-20:]
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark av appen mot lokal fake ClearPass/SMTP.")
+    parser.add_argument("--users", type=int, default=10, help="Antall samtidige teknikere")
+    parser.add_argument("--iterations", type=int, default=5, help="Arbeidsflyt-runder per tekniker")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Maks tilfeldig pause mellom runder (s)")
+    parser.add_argument("--workers", type=int, default=4, help="Antall gunicorn-workere")
+    parser.add_argument("--serving-mode", choices=["async", "sync"], default="async")
+    parser.add_argument("--port", type=int, default=8800, help="Port appen startes på")
+    parser.add_argument("--latency", type=float, default=0.05, help="Forsinkelse per ClearPass-kall (s)")
+    parser.add_argument("--jitter", type=float, default=0.02, help="Tilfeldig ekstra forsinkelse (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Andel ClearPass-kall som svarer 503")
+    parser.add_argument("--seed-devices", type=int, default=500, help="Eksisterende enheter i fake ClearPass")
+    parser.add_argument("--mail-timeout", type=float, default=30, help="Maks ventetid på engangskode (s)")
+    parser.add_argument("--rate-limits", action="store_true", help="Behold rate limiting (slås ellers av)")
+    parser.add_argument("--redis-url", default="redis://localhost:6379/15", help="Redis-database som tømmes og brukes")
+    parser.add_argument("--output", help="Sti til JSON-rapport (standard: bench/results/<tidspunkt>.json)")
+    parser.add_argument("--compare", help="Tidligere rapport å sammenligne med")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"bench-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    summary = report["summary"]
+    print(f"{summary['count']} forespørsler på {report['meta']['wall_time_s']} s: "
+          f"{summary['throughput_rps']} req/s, p50 {summary['p50_ms']} ms, "
+          f"p95 {summary['p95_ms']} ms, p99 {summary['p99_ms']} ms, {summary['errors']} feil")
+    for step, stats in report["steps"].items():
+        print(f"  {step:32} n={stats['count']:<6} p50={stats['p50_ms']} p95={stats['p95_ms']} "
+              f"p99={stats['p99_ms']} feil={stats['errors']}")
+    print(f"Kall mot ClearPass: {json.dumps(report['upstream_calls'], ensure_ascii=False)}")
+    print(f"Rapport: {output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+    return 1 if summary["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
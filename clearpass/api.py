@@ -1,25 +1,39 @@
 """
 ClearPass API-modul for CP-Tekniker Device Management App.
-Inneholder logikk for å hente og opprette enheter via ClearPass, samt caching av access token.
+Inneholder logikk for å hente og opprette enheter via ClearPass. Alle kall går via den felles ClearPass-klienten.
+Når ClearPass er utilgjengelig serveres siste kjente enhetsinfo merket som utdatert, og opprettelser/oppdateringer
+som stoppes av circuit breakeren legges i kø (replay.py) og besvares med 202. Har en MAC-adresse køede
+endringer som ikke er sendt ennå, legges også nye endringer for den i køen, så rekkefølgen beholdes.
+Alle opprettelser og oppdateringer registreres i revisjonsloggen (audit.py) uten å vente på Redis.
 Eksponerer relevante API-endepunkter via Flask Blueprint.
 """
 from flask import Blueprint, request, jsonify, session, current_app as app
-import requests
 import re
-from datetime import datetime, timedelta
+import time
+from concurrent.futures import ThreadPoolExecutor
 from config import Config
 from auth.limiter import limiter
-
-# Token cache for å unngå unødvendige token-forespørsler
-token_cache = {"token": None, "expiry": None}
+from . import audit, breaker, client, device_cache, inventory, replay, singleflight
+from .client import CircuitOpenError, ClearPassAuthError, ClearPassError
+from .utils import normalize_mac
 
 bp = Blueprint('clearpass_api', __name__)
 
+DEVICE_NOT_FOUND = "Enhet ikke funnet."
+CLEARPASS_UNAVAILABLE = "ClearPass er midlertidig utilgjengelig."
+CHANGES_PENDING = "Enheten har køede endringer som ikke er sendt ennå."
+
+# Feil fra create_device/update_device der kallet ikke er sendt og endringen skal legges i kø
+QUEUEABLE_ERRORS = (CLEARPASS_UNAVAILABLE, CHANGES_PENDING)
+
+# Kompileres ved import (i gunicorn-masteren ved preload) og deles av alle workere
+_VID_PATTERN = re.compile(r'^[0-9]{5}$')
+
 def _validate_vid_format(vid):
     """Validerer VirksomhetsID format: 5 tall."""
     if not vid:
         return True  # Tom verdi er tillatt
-    return bool(re.match(r'^[0-9]{5}$', vid))
+    return bool(_VID_PATTERN.match(vid))
 
 def _validate_payload_vid(payload):
     """Validerer VirksomhetsID i payload og returnerer feilmelding hvis ugyldig."""
@@ -28,78 +42,172 @@ def _validate_payload_vid(payload):
         return "VirksomhetsID må være 5 tall (f.eks. 12345)."
     return None
 
-def get_cached_token():
-    """Henter og cacher access token fra ClearPass API."""
-    now = datetime.now()
-    if token_cache["token"] and token_cache["expiry"] and token_cache["expiry"] > now:
-        return token_cache["token"]
-    token_url = f"{Config.BASE_URL}/api/oauth"
-    try:
-        resp = requests.post(
-            token_url,
-            data={
-                "grant_type": "client_credentials",
-                "client_id": Config.CLIENT_ID,
-                "client_secret": Config.CLIENT_SECRET,
-            },
-        )
-        resp.raise_for_status()
-        data = resp.json()
-        token_cache["token"] = data.get("access_token")
-        expires_in = data.get("expires_in", 3600)
-        token_cache["expiry"] = now + timedelta(seconds=expires_in)
-        return token_cache["token"]
-    except Exception as e:
-        app.logger.error(f"Kunne ikke hente token: {e}")
-        return None
-
 def get_device_info(macaddr):
-    """Henter enhetsinformasjon fra ClearPass basert på MAC-adresse."""
-    token = get_cached_token()
-    if not token:
-        return None, "Autentisering feilet."
-    headers = {"Authorization": f"Bearer {token}"}
-    api_url = f"{Config.BASE_URL}/api/device/mac/{macaddr}"
+    """Henter enhetsinformasjon fra ClearPass basert på MAC-adresse.
+    Gyldige MAC-adresser slås først opp i enhetscachen; 404 gir feilen DEVICE_NOT_FOUND.
+    """
+    mac = normalize_mac(macaddr)
+    if mac is None:
+        return _fetch_device_info(macaddr, None)
+    cached = device_cache.get(mac)
+    if cached is not None:
+        found, device_info = cached
+        return (device_info, None) if found else (None, DEVICE_NOT_FOUND)
+    # Samtidige oppslag av samme MAC deler ett kall mot ClearPass
+    return singleflight.do("device", mac, lambda: _fetch_device_info(mac, mac))
+
+def _fetch_device_info(macaddr, mac):
+    """Henter enheten fra ClearPass og oppdaterer cachen når mac (normalisert) er oppgitt.
+    Er ClearPass utilgjengelig, returneres siste kjente enhetsinfo med stale=True og cached_at.
+    """
+    started_at = time.time()
     try:
-        resp = requests.get(api_url, headers=headers)
-        resp.raise_for_status()
-        return resp.json(), None
+        device_info = client.get(f"/api/device/mac/{macaddr}").json()
+    except ClearPassError as e:
+        if e.status_code == 404:
+            if mac is not None:
+                device_cache.store_missing(mac, started_at)
+            return None, DEVICE_NOT_FOUND
+        stale = device_cache.get_stale(mac) if e.unavailable and mac is not None else None
+        if stale is not None:
+            device_info, fetched_at = stale
+            return dict(device_info, stale=True, cached_at=fetched_at), None
+        if isinstance(e, ClearPassAuthError):
+            return None, "Autentisering feilet."
+        if isinstance(e, CircuitOpenError):
+            return None, CLEARPASS_UNAVAILABLE
+        app.logger.error(f"API-forespørsel feilet: {e}")
+        return None, "Kunne ikke hente enhetsinformasjon."
     except Exception as e:
         app.logger.error(f"API-forespørsel feilet: {e}")
         return None, "Kunne ikke hente enhetsinformasjon."
+    if mac is not None:
+        device_cache.store(mac, device_info, started_at)
+    return device_info, None
+
+def _write_through(macaddr, device):
+    """Oppdaterer enhetscachen og enhetsindeksen etter opprettelse/oppdatering (invaliderer cachen ved feil).
+    Returnerer (device, fetched_at) for forrige enhetsinfo i cachen, til revisjonsloggen.
+    """
+    mac = normalize_mac(macaddr)
+    previous = device_cache.write_through(mac, device) if mac is not None else None
+    if isinstance(device, dict) and device:
+        inventory.index_device(dict(device, mac=device.get("mac") or macaddr))
+    return previous
+
+def _elapsed_ms(started):
+    return (time.perf_counter() - started) * 1000
 
-def create_device(payload):
-    """Oppretter ny enhet i ClearPass med gitt payload."""
-    token = get_cached_token()
-    if not token:
-        return None, "Autentisering feilet."
-    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-    api_url = f"{Config.BASE_URL}/api/device"
+def create_device(payload, user_email="", source="api"):
+    """Oppretter ny enhet i ClearPass med gitt payload.
+    Gir feilen CLEARPASS_UNAVAILABLE når breakeren er åpen, og CHANGES_PENDING når MAC-adressen har
+    køede endringer. Da er kallet ikke sendt, og endringen legges i kø (se QUEUEABLE_ERRORS).
+    """
+    macaddr = payload.get("mac")
+    if replay.has_pending(macaddr):
+        return None, CHANGES_PENDING
+    started = time.perf_counter()
     try:
-        resp = requests.post(api_url, headers=headers, json=payload)
-        resp.raise_for_status()
-        return resp.json(), None
+        device = client.post("/api/device", json=payload).json()
+    except CircuitOpenError:
+        return None, CLEARPASS_UNAVAILABLE
+    except ClearPassAuthError:
+        error = "Autentisering feilet."
+        audit.record("create", macaddr, user_email, payload, audit.RESULT_ERROR,
+                     latency_ms=_elapsed_ms(started), error=error, source=source)
+        return None, error
     except Exception as e:
+        latency_ms = _elapsed_ms(started)
         app.logger.error(f"API-forespørsel feilet: {e}")
+        previous = _write_through(macaddr, None)
+        audit.record("create", macaddr, user_email, payload, audit.RESULT_ERROR, previous=previous,
+                     latency_ms=latency_ms, error=str(e), source=source)
         return None, "Kunne ikke opprette enhet."
+    latency_ms = _elapsed_ms(started)
+    previous = _write_through(macaddr, device)
+    audit.record("create", macaddr, user_email, payload, audit.RESULT_SUCCESS, previous=previous, after=device,
+                 latency_ms=latency_ms, source=source)
+    return device, None
 
-def update_device(macaddr, payload):
-    """Oppdaterer enhet i ClearPass basert på MAC-adresse og gitt payload."""
-    token = get_cached_token()
-    if not token:
-        return None, "Autentisering feilet."
-    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-    api_url = f"{Config.BASE_URL}/api/device/mac/{macaddr}"
+def update_device(macaddr, payload, user_email="", source="api"):
+    """Oppdaterer enhet i ClearPass basert på MAC-adresse og gitt payload.
+    Gir feilen CLEARPASS_UNAVAILABLE eller CHANGES_PENDING når kallet ikke er sendt (se create_device).
+    """
+    if replay.has_pending(macaddr):
+        return None, CHANGES_PENDING
+    started = time.perf_counter()
     try:
-        resp = requests.patch(api_url, headers=headers, json=payload)
-        resp.raise_for_status()
-        return resp.json(), None
+        device = client.patch(f"/api/device/mac/{macaddr}", json=payload).json()
+    except CircuitOpenError:
+        return None, CLEARPASS_UNAVAILABLE
+    except ClearPassAuthError:
+        error = "Autentisering feilet."
+        audit.record("update", macaddr, user_email, payload, audit.RESULT_ERROR,
+                     latency_ms=_elapsed_ms(started), error=error, source=source)
+        return None, error
     except Exception as e:
+        latency_ms = _elapsed_ms(started)
         app.logger.error(f"API-forespørsel feilet: {e}")
+        previous = _write_through(macaddr, None)
+        audit.record("update", macaddr, user_email, payload, audit.RESULT_ERROR, previous=previous,
+                     latency_ms=latency_ms, error=str(e), source=source)
         return None, "Kunne ikke oppdatere enhet."
+    latency_ms = _elapsed_ms(started)
+    previous = _write_through(macaddr, device)
+    audit.record("update", macaddr, user_email, payload, audit.RESULT_SUCCESS, previous=previous, after=device,
+                 latency_ms=latency_ms, source=source)
+    return device, None
+
+def queue_change(operation, macaddr, payload, user_email, source="api", reason=CLEARPASS_UNAVAILABLE):
+    """Legger en opprettelse/oppdatering som ikke ble sendt i kø. reason er feilen fra create_device/update_device.
+    Returnerer (svar, feil) for 202-svaret.
+    """
+    entry = replay.enqueue(operation, macaddr, payload, user_email)
+    if entry is None:
+        return None, CLEARPASS_UNAVAILABLE
+    audit.record(operation, macaddr, user_email, payload, audit.RESULT_QUEUED, source=source)
+    return {
+        "queued": True,
+        "id": entry["id"],
+        "mac": macaddr,
+        "message": (
+            "Enheten har endringer som venter på å bli sendt. Endringen er lagt i kø og sendes etter dem."
+            if reason == CHANGES_PENDING else
+            "ClearPass er midlertidig utilgjengelig. Endringen er lagt i kø og sendes når ClearPass svarer igjen."
+        ),
+    }, None
+
+def _unavailable_response():
+    """503-svar med Retry-After mens ClearPass er utilgjengelig."""
+    response = jsonify({"error": CLEARPASS_UNAVAILABLE})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(breaker.status()["retry_after"] or Config.BREAKER_RESET_TIMEOUT)
+    return response
+
+def _mark_stale(response, device_info):
+    """Legger på Warning-header når svaret er siste kjente (utdaterte) enhetsinfo."""
+    if device_info.get("stale"):
+        response.headers["Warning"] = '110 - "Response is Stale"'
+    return response
+
+def get_device_info_many(macaddrs):
+    """Henter enhetsinformasjon for flere MAC-adresser samtidig med begrenset trådpool.
+    Returnerer dict fra MAC-adresse til (device_info, error).
+    """
+    if not macaddrs:
+        return {}
+    flask_app = app._get_current_object()
+
+    def lookup(macaddr):
+        with flask_app.app_context():
+            return get_device_info(macaddr)
+
+    workers = min(Config.BATCH_MAX_WORKERS, len(macaddrs))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(macaddrs, executor.map(lookup, macaddrs)))
 
 @bp.route('/get_device_info', methods=['GET'])
-@limiter.limit("20 per minute")
+@limiter.shared_limit("20 per minute", scope="device_lookup")
 def device_info_route():
     """API-endepunkt for å hente enhetsinfo (krever innlogging)."""
     if not session.get("logged_in") or not session.get("session_token"):
@@ -108,9 +216,48 @@ def device_info_route():
     if not macaddr:
         return jsonify({"error": "MAC-adresse er påkrevd."}), 400
     device_info, error = get_device_info(macaddr)
+    if error == CLEARPASS_UNAVAILABLE:
+        return _unavailable_response()
     if error:
-        return jsonify({"error": error}), 500
-    return jsonify(device_info)
+        return jsonify({"error": error}), 404 if error == DEVICE_NOT_FOUND else 500
+    # ETag lar nettleseren revalidere billig (304) i stedet for å hente hele svaret på nytt
+    response = _mark_stale(jsonify(device_info), device_info)
+    response.headers["Cache-Control"] = "private, no-cache"
+    response.add_etag()
+    return response.make_conditional(request)
+
+@bp.route('/get_device_info/batch', methods=['POST'])
+@limiter.shared_limit("20 per minute", scope="device_lookup")
+def device_info_batch_route():
+    """API-endepunkt for å hente enhetsinfo for flere MAC-adresser i én forespørsel (krever innlogging).
+    Teller som én forespørsel mot samme grense som /get_device_info.
+    """
+    if not session.get("logged_in") or not session.get("session_token"):
+        return jsonify({"error": "Autentisering kreves."}), 401
+    payload = request.get_json(silent=True) or {}
+    macaddrs = payload.get("macs")
+    if not isinstance(macaddrs, list) or not macaddrs:
+        return jsonify({"error": "Liste med MAC-adresser er påkrevd."}), 400
+    if len(macaddrs) > Config.BATCH_MAX_MACS:
+        return jsonify({"error": f"Maks {Config.BATCH_MAX_MACS} MAC-adresser per forespørsel."}), 400
+    normalized = [(raw, normalize_mac(raw)) for raw in macaddrs]
+    unique = list(dict.fromkeys(mac for _, mac in normalized if mac))
+    lookups = get_device_info_many(unique)
+    results = []
+    seen = set()
+    for raw, mac in normalized:
+        if mac is None:
+            results.append({"mac": raw, "error": "Ugyldig MAC-adresse."})
+            continue
+        if mac in seen:
+            continue
+        seen.add(mac)
+        device_info, error = lookups[mac]
+        if error:
+            results.append({"mac": mac, "error": error})
+        else:
+            results.append({"mac": mac, "device": device_info})
+    return jsonify({"results": results})
 
 @bp.route('/create_device', methods=['POST'])
 @limiter.limit("10 per minute")
@@ -128,7 +275,12 @@ def create_device_route():
     if vid_error:
         return jsonify({"error": vid_error}), 400
     
-    device, error = create_device(payload)
+    device, error = create_device(payload, session.get("user_email", ""))
+    if error in QUEUEABLE_ERRORS:
+        queued, error = queue_change("create", payload["mac"], payload, session.get("user_email", ""), reason=error)
+        if queued:
+            return jsonify(queued), 202
+        return _unavailable_response()
     if error:
         return jsonify({"error": error}), 500
     return jsonify(device), 201
@@ -151,7 +303,12 @@ def update_device_route():
     
     patch_payload = dict(payload)
     patch_payload.pop("mac", None)
-    device, error = update_device(macaddr, patch_payload)
+    device, error = update_device(macaddr, patch_payload, session.get("user_email", ""))
+    if error in QUEUEABLE_ERRORS:
+        queued, error = queue_change("update", macaddr, patch_payload, session.get("user_email", ""), reason=error)
+        if queued:
+            return jsonify(queued), 202
+        return _unavailable_response()
     if error:
         return jsonify({"error": error}), 500
     return jsonify(device)
@@ -0,0 +1,267 @@
+"""
+Revisjonslogg for opprettelser og oppdateringer av enheter.
+Hver endring (bruker, MAC, payload, tilstand før og etter, varighet mot ClearPass og resultat) legges i
+en buffer i workeren og returnerer umiddelbart. En bakgrunnstråd sender bufferet i batcher med XADD til
+en Redis-stream (én pipeline per batch), så endringsruten får ingen ekstra rundturer mot Redis.
+Tilstanden før endringen hentes ikke fra ClearPass (det ville doblet antall kall per endring), men er
+siste kjente enhetsinfo fra enhetscachen, lest i samme rundtur som cachen oppdateres (se
+device_cache.write_through). Den kan derfor være opptil DEVICE_CACHE_STALE_TTL gammel, og hendelsen
+har before_source "cache" og before_fetched_at (når kopien ble hentet fra ClearPass). Er enheten ikke
+i cachen, er before og before_source null.
+
+python -m clearpass.audit (startes av supervisord) leser streamen og skriver hendelsene til
+JSONL-filer i AUDIT_LOG_DIR med rotasjon, og legger dem i indekser per MAC og per bruker i Redis
+som GET /audit leser fra. Streamen leses med en consumer group, og en batch kvitteres (XACK) først
+når den er fsyncet til fil. Feiler skrivingen, eller stopper prosessen, leses batchen på nytt.
+"""
+import atexit
+import collections
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+import redis
+
+from config import Config
+from utils import metrics
+from utils.redis import redis_client
+from .utils import normalize_mac
+
+logger = logging.getLogger(__name__)
+
+STREAM_KEY = "audit:events"
+GROUP = "audit-writer"
+CONSUMER = "writer"  # Én skriver; fast navn slik at ukvitterte hendelser finnes igjen etter omstart
+MAC_INDEX_KEY = "audit:mac:{mac}"
+USER_INDEX_KEY = "audit:user:{user}"
+LOG_FILE = "audit.jsonl"
+
+RESULT_SUCCESS = "success"
+RESULT_ERROR = "error"
+RESULT_QUEUED = "queued"
+
+
+def _mac_key(mac):
+    return MAC_INDEX_KEY.format(mac=normalize_mac(mac) or str(mac).lower())
+
+
+def _user_key(user):
+    return USER_INDEX_KEY.format(user=(user or "").lower())
+
+
+class _Buffer:
+    """Buffer per worker-prosess som sendes til streamen av en bakgrunnstråd.
+    Tråden startes ved første hendelse i hver prosess, slik at den ikke startes i gunicorn-masteren før fork.
+    """
+
+    def __init__(self):
+        self._events = collections.deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+
+    def append(self, event):
+        if self._pid != os.getpid():
+            self._start()
+        with self._lock:
+            if len(self._events) >= Config.AUDIT_BUFFER_MAX:
+                # Redis har vært nede lenge: eldste hendelse forkastes i stedet for å vokse uten grense
+                self._events.popleft()
+                metrics.AUDIT_EVENTS.labels("dropped").inc()
+            self._events.append(event)
+            full = len(self._events) >= Config.AUDIT_BATCH_SIZE
+        if full:
+            self._wakeup.set()
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._events.clear()  # Arvet fra forelderprosessen, som sender sine egne
+        threading.Thread(target=self._run, name="audit-writer", daemon=True).start()
+        atexit.register(self._flush_at_exit)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(Config.AUDIT_FLUSH_INTERVAL)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except redis.RedisError as e:
+                logger.warning(f"Kunne ikke skrive revisjonslogg til Redis, prøver igjen: {e}")
+
+    def _flush_at_exit(self):
+        try:
+            self.flush()
+        except redis.RedisError as e:
+            logger.error(f"{len(self._events)} hendelser i revisjonsloggen gikk tapt ved nedstenging: {e}")
+
+    def flush(self):
+        """Sender alt i bufferet til streamen. Ved Redis-feil legges batchen tilbake først i bufferet."""
+        while True:
+            with self._lock:
+                batch = [self._events.popleft() for _ in range(min(len(self._events), Config.AUDIT_BATCH_SIZE))]
+            if not batch:
+                return
+            pipe = redis_client.pipeline(transaction=False)
+            for event in batch:
+                pipe.xadd(STREAM_KEY, {"event": json.dumps(event, ensure_ascii=False)},
+                          maxlen=Config.AUDIT_STREAM_MAXLEN, approximate=True)
+            try:
+                pipe.execute()
+            except redis.RedisError:
+                with self._lock:
+                    self._events.extendleft(reversed(batch))
+                raise
+            metrics.AUDIT_EVENTS.labels("buffered").inc(len(batch))
+
+
+_buffer = _Buffer()
+
+
+def record(operation, mac, user, payload, result, previous=None, after=None, latency_ms=None, error=None,
+           source="api"):
+    """Registrerer én endring. Gjør ingen I/O; hendelsen sendes til Redis av bakgrunnstråden.
+    previous er (device, fetched_at) fra enhetscachen før endringen, eller None.
+    """
+    before, before_fetched_at = previous or (None, None)
+    _buffer.append({
+        "id": uuid.uuid4().hex,
+        "ts": time.time(),
+        "operation": operation,
+        "mac": normalize_mac(mac) or mac,
+        "user": (user or "").lower(),
+        "source": source,
+        "result": result,
+        "error": error,
+        "latency_ms": round(latency_ms, 1) if latency_ms is not None else None,
+        "payload": payload,
+        "before": before,
+        "before_source": "cache" if previous else None,
+        "before_fetched_at": before_fetched_at,
+        "after": after,
+    })
+
+
+def flush():
+    """Sender bufrede hendelser til streamen nå i stedet for å vente på bakgrunnstråden."""
+    _buffer.flush()
+
+
+def query(mac=None, user=None, limit=50):
+    """Returnerer de nyeste hendelsene (nyeste først) for en MAC-adresse eller en bruker."""
+    key = _mac_key(mac) if mac else _user_key(user)
+    return [json.loads(raw) for raw in redis_client.lrange(key, 0, limit - 1)]
+
+
+class JsonlFile:
+    """Append-only JSONL-fil som roteres når den når AUDIT_LOG_MAX_BYTES (audit.jsonl.1, .2, ...).
+    Hver batch skrives, flushes og fsynces før write returnerer. Skrivefeil kastes videre, slik at
+    batchen ikke kvitteres i streamen og leveres på nytt.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or Config.AUDIT_LOG_DIR
+        self.path = os.path.join(self.directory, LOG_FILE)
+        self._file = None
+
+    def write(self, lines):
+        if self._file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+        try:
+            if self._file.tell() >= Config.AUDIT_LOG_MAX_BYTES:
+                self._rotate()
+            self._file.write("".join(line + "\n" for line in lines))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except OSError:
+            self.close()  # Åpnes på nytt ved neste forsøk
+            raise
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        for index in range(Config.AUDIT_LOG_BACKUPS - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if Config.AUDIT_LOG_BACKUPS > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def close(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+
+
+def _write(log_file, entries):
+    """Skriver en batch fra streamen til fil og indekser, og kvitterer den (XACK) først når fila er fsyncet."""
+    lines = []
+    pipe = redis_client.pipeline(transaction=False)
+    for _, fields in entries:
+        raw = (fields or {}).get("event")
+        if raw is None:
+            continue  # Trimmet fra streamen før den ble skrevet; kvitteres likevel
+        lines.append(raw)
+        event = json.loads(raw)
+        for key in (_mac_key(event["mac"]), _user_key(event["user"])):
+            pipe.lpush(key, raw)
+            pipe.ltrim(key, 0, Config.AUDIT_INDEX_MAX - 1)
+    if lines:
+        log_file.write(lines)
+    pipe.xack(STREAM_KEY, GROUP, *[entry_id for entry_id, _ in entries])
+    pipe.execute()
+    metrics.AUDIT_EVENTS.labels("written").inc(len(lines))
+
+
+def drain(log_file, pending=False, block_ms=None):
+    """Leser og skriver én batch fra streamen. Returnerer antall hendelser.
+    Med pending=True leses hendelser som ble lest, men ikke kvittert, av en tidligere kjøring.
+    """
+    response = redis_client.xreadgroup(
+        GROUP, CONSUMER, {STREAM_KEY: "0" if pending else ">"}, count=Config.AUDIT_BATCH_SIZE, block=block_ms,
+    )
+    entries = response[0][1] if response else []
+    if entries:
+        _write(log_file, entries)
+    return len(entries)
+
+
+def run():
+    """Hovedløkke for skriveren av revisjonsloggen."""
+    log_file = JsonlFile()
+    logger.info(f"Revisjonslogg skrives til {Config.AUDIT_LOG_DIR}.")
+    while True:
+        try:
+            redis_client.xgroup_create(STREAM_KEY, GROUP, id="0", mkstream=True)
+        except redis.ResponseError:
+            pass  # Gruppen finnes allerede
+        except redis.RedisError as e:
+            logger.error(f"Revisjonslogg: Redis utilgjengelig: {e}")
+            time.sleep(Config.AUDIT_FLUSH_INTERVAL * 10)
+            continue
+        try:
+            while drain(log_file, pending=True):
+                pass
+            while True:
+                drain(log_file, block_ms=5000)
+        except (redis.RedisError, OSError) as e:
+            # Batchen er ikke kvittert og leses på nytt fra streamen
+            logger.error(f"Skriving av revisjonslogg feilet: {e}")
+            time.sleep(Config.AUDIT_FLUSH_INTERVAL * 10)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    run()
@@ -0,0 +1,154 @@
+"""
+Circuit breaker for kall mot ClearPass, med tilstand delt mellom alle workere via Redis.
+Når ClearPass svarer med nettverksfeil, timeout eller 5xx BREAKER_FAILURE_THRESHOLD ganger innenfor
+BREAKER_FAILURE_WINDOW sekunder, åpnes bryteren. Alle kall feiler da umiddelbart med CircuitOpenError
+(se client.py) i stedet for å binde opp workere i timeouts. Etter BREAKER_RESET_TIMEOUT slippes én
+prøveforespørsel gjennom (halvåpen): lykkes den lukkes bryteren, feiler den holdes bryteren åpen en ny periode.
+Hver worker holder en lokal kopi av tilstanden i BREAKER_STATE_REFRESH sekunder, slik at vanlige
+kall i lukket tilstand ikke trenger å gå mot Redis. Er Redis nede, slippes alle kall gjennom.
+"""
+import logging
+import threading
+import time
+
+import redis
+
+from config import Config
+from utils import metrics
+from utils.redis import redis_client
+
+logger = logging.getLogger(__name__)
+
+STATE_KEY = "clearpass:breaker"
+FAILURES_KEY = "clearpass:breaker:failures"
+PROBE_KEY = "clearpass:breaker:probe"
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# KEYS: tilstand, feilteller. ARGV: terskel, vindu (s), nå (epoch), prøveforespørsel (1/0).
+# Returnerer ny tilstand hvis bryteren ble åpnet, ellers tom streng.
+_RECORD_FAILURE = redis_client.register_script("""
+local state = redis.call('HGET', KEYS[1], 'state')
+if state == 'open' then
+    if ARGV[4] == '1' then
+        redis.call('HSET', KEYS[1], 'opened_at', ARGV[3])
+        return 'open'
+    end
+    return ''
+end
+local failures = redis.call('INCR', KEYS[2])
+if failures == 1 then
+    redis.call('EXPIRE', KEYS[2], ARGV[2])
+end
+if failures >= tonumber(ARGV[1]) then
+    redis.call('HSET', KEYS[1], 'state', 'open', 'opened_at', ARGV[3])
+    redis.call('DEL', KEYS[2])
+    return 'open'
+end
+return ''
+""")
+
+# KEYS: tilstand, feilteller, prøvelås. Returnerer 1 hvis bryteren ble lukket.
+_CLOSE = redis_client.register_script("""
+redis.call('DEL', KEYS[2], KEYS[3])
+if redis.call('HGET', KEYS[1], 'state') == 'open' then
+    redis.call('HSET', KEYS[1], 'state', 'closed', 'opened_at', 0)
+    return 1
+end
+return 0
+""")
+
+
+# Lokal kopi av delt tilstand (per worker). checked_at er monotonic-tid for siste lesing fra Redis.
+_local = {"state": CLOSED, "opened_at": 0.0, "checked_at": float("-inf")}
+_local_lock = threading.Lock()
+
+
+def _snapshot():
+    """Returnerer (state, opened_at) fra lokal kopi, lest på nytt fra Redis når den er eldre enn BREAKER_STATE_REFRESH."""
+    now = time.monotonic()
+    if now - _local["checked_at"] < Config.BREAKER_STATE_REFRESH:
+        return _local["state"], _local["opened_at"]
+    with _local_lock:
+        if now - _local["checked_at"] >= Config.BREAKER_STATE_REFRESH:
+            try:
+                state, opened_at = redis_client.hmget(STATE_KEY, "state", "opened_at")
+            except redis.RedisError as e:
+                logger.warning(f"Kunne ikke lese circuit breaker-tilstand: {e}")
+                state, opened_at = CLOSED, 0
+            _local.update({"state": state or CLOSED, "opened_at": float(opened_at or 0), "checked_at": now})
+    return _local["state"], _local["opened_at"]
+
+
+def _set_local(state, opened_at):
+    _local.update({"state": state, "opened_at": opened_at, "checked_at": time.monotonic()})
+
+
+def status():
+    """Returnerer gjeldende tilstand som dict (state, opened_at, retry_after) for helse-endepunkter."""
+    state, opened_at = _snapshot()
+    if state != OPEN:
+        return {"state": CLOSED, "opened_at": None, "retry_after": 0}
+    remaining = opened_at + Config.BREAKER_RESET_TIMEOUT - time.time()
+    return {
+        "state": OPEN if remaining > 0 else HALF_OPEN,
+        "opened_at": opened_at,
+        "retry_after": max(int(remaining + 0.999), 0),
+    }
+
+
+def acquire():
+    """Kalles før et kall mot ClearPass. Returnerer True hvis kallet er prøveforespørselen i halvåpen tilstand,
+    False for et vanlig kall, og None hvis kallet skal avvises.
+    """
+    state, opened_at = _snapshot()
+    if state != OPEN:
+        return False
+    remaining = opened_at + Config.BREAKER_RESET_TIMEOUT - time.time()
+    if remaining <= 0:
+        probe_ttl = int(Config.CLEARPASS_CONNECT_TIMEOUT + Config.CLEARPASS_READ_TIMEOUT) + 1
+        try:
+            if redis_client.set(PROBE_KEY, "1", nx=True, ex=probe_ttl):
+                return True
+        except redis.RedisError as e:
+            logger.warning(f"Circuit breaker utilgjengelig, slipper kallet gjennom: {e}")
+            return False
+    metrics.CLEARPASS_BREAKER_REJECTIONS.inc()
+    return None
+
+
+def record_success(probe):
+    """Registrerer et vellykket kall. Lukker bryteren hvis den ikke allerede er lukket."""
+    if not probe and _local["state"] != OPEN:
+        return
+    try:
+        closed = _CLOSE(keys=[STATE_KEY, FAILURES_KEY, PROBE_KEY])
+    except redis.RedisError as e:
+        logger.warning(f"Kunne ikke lukke circuit breaker: {e}")
+        return
+    _set_local(CLOSED, 0.0)
+    if closed:
+        logger.info("Circuit breaker lukket: ClearPass svarer igjen.")
+        metrics.CLEARPASS_BREAKER_TRANSITIONS.labels(CLOSED).inc()
+
+
+def record_failure(probe):
+    """Registrerer et kall som feilet fordi ClearPass er utilgjengelig (nettverksfeil, timeout, 5xx)."""
+    now = time.time()
+    try:
+        opened = _RECORD_FAILURE(
+            keys=[STATE_KEY, FAILURES_KEY],
+            args=[Config.BREAKER_FAILURE_THRESHOLD, Config.BREAKER_FAILURE_WINDOW, now, 1 if probe else 0],
+        )
+        if probe:
+            redis_client.delete(PROBE_KEY)
+    except redis.RedisError as e:
+        logger.warning(f"Kunne ikke oppdatere circuit breaker: {e}")
+        return
+    if opened:
+        _set_local(OPEN, now)
+        if not probe:
+            logger.warning(f"Circuit breaker åpnet: ClearPass-kall avvises i {Config.BREAKER_RESET_TIMEOUT} s.")
+            metrics.CLEARPASS_BREAKER_TRANSITIONS.labels(OPEN).inc()
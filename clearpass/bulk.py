@@ -0,0 +1,186 @@
+"""
+Blueprint for masseimport av enheter (opprettelse/oppdatering) fra CSV eller JSON.
+Alle rader valideres før noe sendes til ClearPass. Deretter utføres radene samtidig med
+begrenset trådpool, og fremdrift og resultat per rad strømmes tilbake som NDJSON.
+Rader for samme MAC-adresse utføres etter hverandre i filens rekkefølge, slik at siste rad gjelder.
+Rader som stoppes av circuit breakeren legges i kø og rapporteres med status "queued".
+"""
+import csv
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from flask import Blueprint, request, jsonify, session, Response, stream_with_context, current_app as app
+
+from config import Config
+from auth.limiter import limiter
+from .api import QUEUEABLE_ERRORS, create_device, queue_change, update_device, _validate_payload_vid
+from .utils import normalize_mac
+
+bp = Blueprint('clearpass_bulk', __name__)
+
+BULK_MODES = ("create", "update")
+_BOOL_FIELDS = ("enabled",)
+_INT_FIELDS = ("expire_time",)
+
+
+def _coerce_row(row):
+    """Konverterer CSV-verdier (tekst) til riktige typer og fjerner tomme felt."""
+    cleaned = {}
+    for key, value in row.items():
+        if key is None:
+            continue
+        key = key.strip()
+        if isinstance(value, str):
+            value = value.strip()
+            if value == "":
+                continue
+            if key in _BOOL_FIELDS:
+                value = value.lower() in ("1", "true", "ja", "yes")
+            elif key in _INT_FIELDS:
+                try:
+                    value = int(value)
+                except ValueError:
+                    pass
+        cleaned[key] = value
+    return cleaned
+
+
+def _parse_rows():
+    """Leser rader fra opplastet fil (CSV/JSON), CSV-body eller JSON-body. Kaster ValueError ved feil format."""
+    upload = request.files.get("file")
+    if upload is not None:
+        raw = upload.read().decode("utf-8-sig")
+        is_json = upload.filename.lower().endswith(".json") or upload.mimetype == "application/json"
+    elif request.is_json:
+        data = request.get_json(silent=True)
+        if data is None:
+            raise ValueError("Ugyldig JSON.")
+        return data.get("devices") if isinstance(data, dict) else data
+    else:
+        raw = request.get_data(as_text=True)
+        is_json = False
+    if is_json:
+        data = json.loads(raw)
+        return data.get("devices") if isinstance(data, dict) else data
+    return list(csv.DictReader(io.StringIO(raw)))
+
+
+def _validate_rows(rows, mode):
+    """Validerer alle rader. Returnerer (payloads, errors) der errors er en liste med radfeil."""
+    payloads = []
+    errors = []
+    user_email = session.get("user_email", "")
+    for index, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            errors.append({"row": index, "error": "Raden må være et objekt."})
+            continue
+        payload = _coerce_row(row)
+        mac = normalize_mac(payload.get("mac"))
+        if mac is None:
+            errors.append({"row": index, "error": "Ugyldig eller manglende MAC-adresse."})
+            continue
+        payload["mac"] = mac
+        if mode == "create" and "role_id" not in payload:
+            errors.append({"row": index, "mac": mac, "error": "Påkrevde felt mangler: ['mac', 'role_id']"})
+            continue
+        vid = payload.get("vid")
+        if isinstance(vid, int) and not isinstance(vid, bool):
+            payload["vid"] = vid = str(vid)  # JSON-import kan ha VirksomhetsID som tall
+        if vid is not None and not isinstance(vid, str):
+            errors.append({"row": index, "mac": mac, "error": "VirksomhetsID må være 5 tall (f.eks. 12345)."})
+            continue
+        vid_error = _validate_payload_vid(payload)
+        if vid_error:
+            errors.append({"row": index, "mac": mac, "error": vid_error})
+            continue
+        payload.setdefault("sponsor_name", user_email)
+        payload.setdefault("sponsor_profile", "1")
+        payloads.append(payload)
+    return payloads, errors
+
+
+def _execute(payload, mode, user_email):
+    """Utfører én rad mot ClearPass. Returnerer (device, error, queued)."""
+    if mode == "create":
+        macaddr, body = payload["mac"], payload
+        device, error = create_device(payload, user_email, source="bulk")
+    else:
+        body = dict(payload)
+        macaddr = body.pop("mac")
+        device, error = update_device(macaddr, body, user_email, source="bulk")
+    if error in QUEUEABLE_ERRORS:
+        queued, queue_error = queue_change(mode, macaddr, body, user_email, source="bulk", reason=error)
+        if queued:
+            return None, None, queued
+        error = queue_error
+    return device, error, None
+
+
+def _ndjson(obj):
+    """Serialiserer ett objekt som én NDJSON-linje."""
+    return json.dumps(obj, ensure_ascii=False) + "\n"
+
+
+@bp.route('/bulk_devices', methods=['POST'])
+@limiter.limit("5 per minute")
+def bulk_devices_route():
+    """API-endepunkt for masseopprettelse/-oppdatering av enheter (krever innlogging).
+    Svarer med NDJSON: én start-linje, én linje per rad etter hvert som de fullføres, og en oppsummering.
+    """
+    if not session.get("logged_in") or not session.get("session_token"):
+        return jsonify({"error": "Autentisering kreves."}), 401
+    mode = request.args.get("mode", "create")
+    if mode not in BULK_MODES:
+        return jsonify({"error": f"Ugyldig modus. Gyldige verdier: {list(BULK_MODES)}"}), 400
+    try:
+        rows = _parse_rows()
+    except (ValueError, UnicodeDecodeError, csv.Error):
+        return jsonify({"error": "Kunne ikke lese filen. Bruk CSV med overskriftsrad eller en JSON-liste."}), 400
+    if not isinstance(rows, list) or not rows:
+        return jsonify({"error": "Ingen enheter å importere."}), 400
+    if len(rows) > Config.BULK_MAX_ROWS:
+        return jsonify({"error": f"Maks {Config.BULK_MAX_ROWS} enheter per import."}), 400
+    payloads, errors = _validate_rows(rows, mode)
+    if errors:
+        return jsonify({"error": "Valideringsfeil i importen. Ingen enheter er endret.", "rows": errors}), 400
+
+    flask_app = app._get_current_object()
+    user_email = session.get("user_email", "")
+
+    # Rader for samme MAC utføres etter hverandre; ulike MAC-adresser samtidig
+    groups = {}
+    for index, payload in enumerate(payloads, start=1):
+        groups.setdefault(payload["mac"], []).append((index, payload))
+
+    def run(rows):
+        with flask_app.app_context():
+            return [(index, payload["mac"], _execute(payload, mode, user_email)) for index, payload in rows]
+
+    def generate():
+        yield _ndjson({"type": "start", "mode": mode, "total": len(payloads)})
+        succeeded = 0
+        queued = 0
+        workers = min(Config.BULK_MAX_WORKERS, len(groups))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(run, rows) for rows in groups.values()]
+            for future in as_completed(futures):
+                for index, mac, (device, error, queue_entry) in future.result():
+                    if queue_entry:
+                        queued += 1
+                        yield _ndjson({"type": "result", "row": index, "mac": mac, "status": "queued", "id": queue_entry["id"]})
+                    elif error:
+                        yield _ndjson({"type": "result", "row": index, "mac": mac, "status": "error", "error": error})
+                    else:
+                        succeeded += 1
+                        yield _ndjson({"type": "result", "row": index, "mac": mac, "status": "ok", "device": device})
+        yield _ndjson({
+            "type": "done", "total": len(payloads), "succeeded": succeeded, "queued": queued,
+            "failed": len(payloads) - succeeded - queued,
+        })
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
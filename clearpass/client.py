@@ -0,0 +1,173 @@
+"""
+Felles HTTP-klient for alle kall mot ClearPass.
+Gjenbruker TCP/TLS-forbindelser via en requests.Session per worker, setter timeouts på alle kall,
+prøver idempotente GET-kall på nytt med jitter, og henter nytt token én gang ved 401.
+Alle kall går gjennom circuit breakeren (breaker.py), slik at kall feiler umiddelbart mens ClearPass er nede.
+requests importeres først ved første kall (eller i gunicorn-masteren via app.warm_up ved preload),
+slik at prosesser som ikke snakker med ClearPass slipper importkostnaden.
+"""
+import logging
+import os
+import random
+import threading
+import time
+
+from config import Config
+from utils import metrics
+from . import breaker
+from .token_cache import get_cached_token, invalidate_token, last_failure_status
+
+logger = logging.getLogger(__name__)
+
+# Statuskoder som tyder på forbigående feil hos ClearPass og som trygt kan prøves på nytt for GET
+RETRY_STATUSES = {502, 503, 504}
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+class ClearPassError(Exception):
+    """Feil ved kall mot ClearPass. status_code er None ved nettverksfeil/timeout."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+    @property
+    def unavailable(self):
+        """True når feilen tyder på at ClearPass er nede eller overbelastet (nettverksfeil, timeout eller 5xx)."""
+        return self.status_code is None or self.status_code >= 500
+
+
+class ClearPassAuthError(ClearPassError):
+    """Kunne ikke skaffe gyldig access token. status_code er svaret fra /api/oauth, slik at avvist
+    klientlegitimasjon (4xx) ikke teller som feil i circuit breakeren, mens et token-endepunkt som
+    ikke kan nås (None) eller svarer 5xx gjør det.
+    """
+
+    def __init__(self, message, status_code=401):
+        super().__init__(message, status_code)
+
+
+class CircuitOpenError(ClearPassError):
+    """Circuit breakeren er åpen, så kallet ble ikke sendt. retry_after er sekunder til neste prøve."""
+
+    def __init__(self, retry_after):
+        super().__init__("ClearPass er midlertidig utilgjengelig.")
+        self.retry_after = retry_after
+
+
+def get_session():
+    """Returnerer workerens requests.Session. Opprettes på nytt etter fork slik at sockets ikke deles."""
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is not None and _session_pid == pid:
+        return _session
+    with _session_lock:
+        if _session is None or _session_pid != pid:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=Config.CLEARPASS_POOL_SIZE,
+                max_retries=0,
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+            _session_pid = pid
+    return _session
+
+
+def get_timeout():
+    """(connect, read)-timeout for kall mot ClearPass."""
+    return (Config.CLEARPASS_CONNECT_TIMEOUT, Config.CLEARPASS_READ_TIMEOUT)
+
+
+def _backoff(attempt):
+    """Eksponentiell backoff med full jitter."""
+    delay = min(Config.CLEARPASS_RETRY_BACKOFF * (2 ** attempt), Config.CLEARPASS_RETRY_BACKOFF_MAX)
+    time.sleep(random.uniform(0, delay))
+
+
+def request(method, path, **kwargs):
+    """Utfører et autentisert kall mot ClearPass og returnerer requests.Response.
+
+    GET-kall prøves på nytt inntil CLEARPASS_MAX_RETRIES ganger ved nettverksfeil,
+    timeout eller 502/503/504. Ved 401 forkastes tokenet og kallet gjøres én gang til.
+    Kaster ClearPassError ved feil, og CircuitOpenError uten å kalle ClearPass når breakeren er åpen.
+    Utfallet (etter eventuelle nye forsøk) registreres i breakeren.
+    """
+    probe = breaker.acquire()
+    if probe is None:
+        raise CircuitOpenError(breaker.status()["retry_after"] or 1)
+    try:
+        resp = _send(method, path, **kwargs)
+    except ClearPassError as e:
+        if e.unavailable:
+            breaker.record_failure(probe)
+        else:
+            breaker.record_success(probe)
+        raise
+    breaker.record_success(probe)
+    return resp
+
+
+def _send(method, path, **kwargs):
+    """Utfører kallet med nye forsøk og token-fornying (se request)."""
+    import requests
+    method = method.upper()
+    url = f"{Config.BASE_URL}{path}"
+    retries = Config.CLEARPASS_MAX_RETRIES if method == "GET" else 0
+    headers = dict(kwargs.pop("headers", None) or {})
+    session = get_session()
+    reauthenticated = False
+    attempt = 0
+    while True:
+        token = get_cached_token()
+        if not token:
+            raise ClearPassAuthError("Autentisering feilet.", status_code=last_failure_status())
+        headers["Authorization"] = f"Bearer {token}"
+        started = time.perf_counter()
+        try:
+            resp = session.request(method, url, headers=headers, timeout=get_timeout(), **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            metrics.observe_clearpass(method, path, "error", started)
+            if attempt < retries:
+                logger.warning(f"ClearPass {method} {path} feilet ({e}), prøver igjen")
+                _backoff(attempt)
+                attempt += 1
+                continue
+            raise ClearPassError(f"ClearPass utilgjengelig: {e}") from e
+        metrics.observe_clearpass(method, path, resp.status_code, started)
+        if resp.status_code == 401 and not reauthenticated:
+            invalidate_token(token)
+            reauthenticated = True
+            continue
+        if resp.status_code in RETRY_STATUSES and attempt < retries:
+            _backoff(attempt)
+            attempt += 1
+            continue
+        if resp.status_code >= 400:
+            raise ClearPassError(
+                f"ClearPass svarte {resp.status_code} på {method} {path}",
+                status_code=resp.status_code,
+            )
+        return resp
+
+
+def get(path, **kwargs):
+    """GET mot ClearPass."""
+    return request("GET", path, **kwargs)
+
+
+def post(path, **kwargs):
+    """POST mot ClearPass."""
+    return request("POST", path, **kwargs)
+
+
+def patch(path, **kwargs):
+    """PATCH mot ClearPass."""
+    return request("PATCH", path, **kwargs)
@@ -0,0 +1,135 @@
+"""
+Kortlivet cache for enhetsinformasjon fra ClearPass.
+Oppslag lagres i Redis per normalisert MAC-adresse med kort TTL, og 404-svar caches negativt
+med enda kortere TTL. Opprettelse og oppdatering skriver det ferske svaret rett inn i cachen,
+slik at brukeren aldri ser utdatert informasjon etter egne endringer.
+Oppføringer beholdes i DEVICE_CACHE_STALE_TTL etter at de er utløpt, slik at siste kjente
+enhetsinfo kan serveres (merket som utdatert) når ClearPass er nede.
+Et oppslag som startet før en endring, kan fullføre etter den. store og store_missing får derfor
+tidspunktet oppslaget startet, og et Lua-skript lar være å skrive hvis oppføringen i cachen er
+skrevet eller invalidert (fetched_at/invalidated_at) etter det.
+"""
+import json
+import logging
+import time
+
+import redis
+
+from config import Config
+from utils import metrics
+from utils.redis import redis_client
+
+logger = logging.getLogger(__name__)
+
+DEVICE_KEY = "device:{mac}"
+
+# KEYS: nøkkel. ARGV: ny oppføring, tidspunkt oppslaget startet, TTL.
+# Skriver ikke over en oppføring som er oppdatert eller invalidert etter at oppslaget startet.
+_STORE_IF_OLDER = redis_client.register_script("""
+local raw = redis.call('GET', KEYS[1])
+if raw then
+    local ok, current = pcall(cjson.decode, raw)
+    if ok and type(current) == 'table' then
+        local changed = current['fetched_at'] or current['invalidated_at']
+        if type(changed) == 'number' and changed > tonumber(ARGV[2]) then
+            return 0
+        end
+    end
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+return 1
+""")
+
+
+def _key(mac):
+    """Redis-nøkkel for en normalisert MAC-adresse."""
+    return DEVICE_KEY.format(mac=mac)
+
+
+def get(mac):
+    """Returnerer (found, device) fra cache, eller None ved cache-miss.
+    found er False når ClearPass nylig svarte 404 for MAC-adressen.
+    """
+    try:
+        raw = redis_client.get(_key(mac))
+    except redis.RedisError as e:
+        logger.warning(f"Kunne ikke lese enhetscache: {e}")
+        return None
+    if raw is None:
+        metrics.CACHE_REQUESTS.labels("device", "miss").inc()
+        return None
+    entry = json.loads(raw)
+    if entry.get("missing"):
+        metrics.CACHE_REQUESTS.labels("device", "negative_hit").inc()
+        return False, None
+    if "device" not in entry:
+        # Invalidert etter en endring
+        metrics.CACHE_REQUESTS.labels("device", "miss").inc()
+        return None
+    if time.time() - entry.get("fetched_at", time.time()) >= Config.DEVICE_CACHE_TTL:
+        # Utløpt, men beholdt for get_stale
+        metrics.CACHE_REQUESTS.labels("device", "miss").inc()
+        return None
+    metrics.CACHE_REQUESTS.labels("device", "hit").inc()
+    return True, entry["device"]
+
+
+def get_stale(mac):
+    """Returnerer (device, fetched_at) for siste kjente enhetsinfo uansett alder, eller None.
+    Brukes når ClearPass er utilgjengelig.
+    """
+    try:
+        raw = redis_client.get(_key(mac))
+    except redis.RedisError as e:
+        logger.warning(f"Kunne ikke lese enhetscache: {e}")
+        return None
+    entry = json.loads(raw) if raw else {}
+    if "device" not in entry:
+        return None
+    metrics.CACHE_REQUESTS.labels("device", "stale").inc()
+    return entry["device"], entry.get("fetched_at")
+
+
+def _store_if_older(mac, entry, started_at, ttl):
+    try:
+        if not _STORE_IF_OLDER(keys=[_key(mac)], args=[json.dumps(entry), started_at, ttl]):
+            logger.debug(f"Enhetscache for {mac} er endret under oppslaget; lagres ikke.")
+    except redis.RedisError as e:
+        logger.warning(f"Kunne ikke lagre i enhetscache: {e}")
+
+
+def store(mac, device, started_at):
+    """Lagrer enhetsinformasjon fra et oppslag som startet ved started_at (time.time()),
+    med mindre cachen er oppdatert etter at oppslaget startet.
+    """
+    entry = {"device": device, "fetched_at": time.time()}
+    _store_if_older(mac, entry, started_at, Config.DEVICE_CACHE_TTL + Config.DEVICE_CACHE_STALE_TTL)
+
+
+def store_missing(mac, started_at):
+    """Cacher at enheten ikke finnes i ClearPass (negativ caching), med samme kontroll som store."""
+    _store_if_older(mac, {"missing": True, "fetched_at": time.time()}, started_at, Config.DEVICE_CACHE_NEGATIVE_TTL)
+
+
+def write_through(mac, device):
+    """Oppdaterer cachen etter en endring: lagrer svaret hvis det er en enhet, ellers invalideres nøkkelen
+    (med invalidated_at, slik at oppslag som startet før endringen ikke lagrer gammel enhetsinfo).
+    Returnerer (device, fetched_at) for forrige enhetsinfo i cachen (uansett alder, hentet i samme
+    rundtur), eller None.
+    """
+    now = time.time()
+    if isinstance(device, dict) and device:
+        entry = {"device": device, "fetched_at": now}
+    else:
+        entry = {"invalidated_at": now}
+    try:
+        raw = redis_client.set(
+            _key(mac), json.dumps(entry), ex=Config.DEVICE_CACHE_TTL + Config.DEVICE_CACHE_STALE_TTL, get=True,
+        )
+    except redis.RedisError as e:
+        logger.warning(f"Kunne ikke oppdatere enhetscache: {e}")
+        return None
+    entry = json.loads(raw) if raw else {}
+    if "device" not in entry:
+        return None
+    return entry["device"], entry.get("fetched_at")
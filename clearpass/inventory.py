@@ -0,0 +1,224 @@
+"""
+Lokal, søkbar indeks over enhetene i ClearPass.
+Synkroniseres i bakgrunnen av python -m clearpass.inventory (startes av supervisord): nye enheter
+hentes inkrementelt side for side etter id, og en full gjennomgang med jevne mellomrom fanger opp
+endringer og slettinger. Indeksen lagres kompakt i Redis: én hash med enhetene, et sortert sett
+for prefikssøk på MAC-adresse og ett sett per VirksomhetsID (vid) og per rolle.
+"""
+import json
+import logging
+import time
+
+import redis
+
+from config import Config
+from utils import metrics
+from utils.redis import redis_client
+from . import client
+from .client import ClearPassError
+from .utils import normalize_mac
+
+logger = logging.getLogger("inventory")
+
+DEVICE_PATH = "/api/device"
+DEVICES_KEY = "inventory:devices"
+MACS_KEY = "inventory:macs"
+VID_KEY = "inventory:vid:{vid}"
+ROLE_KEY = "inventory:role:{role_id}"
+META_KEY = "inventory:meta"
+SYNC_LOCK_KEY = "inventory:sync:lock"
+
+# Feltene som lagres i indeksen
+INDEXED_FIELDS = ("id", "vid", "role_id", "visitor_name", "enabled", "expire_time")
+
+
+def compact(device):
+    """Lager en kompakt indeksoppføring av en enhet fra ClearPass. Returnerer None uten gyldig MAC."""
+    mac = normalize_mac(device.get("mac")) if isinstance(device, dict) else None
+    if mac is None:
+        return None
+    entry = {"mac": mac}
+    for field in INDEXED_FIELDS:
+        if device.get(field) not in (None, ""):
+            entry[field] = device[field]
+    return entry
+
+
+def _unindex(pipe, entry):
+    """Fjerner enheten fra vid- og rollesettene."""
+    if entry.get("vid"):
+        pipe.srem(VID_KEY.format(vid=entry["vid"]), entry["mac"])
+    if entry.get("role_id") is not None:
+        pipe.srem(ROLE_KEY.format(role_id=entry["role_id"]), entry["mac"])
+
+
+def upsert_many(devices):
+    """Legger inn eller oppdaterer enheter i indeksen med to rundturer. Returnerer antall indekserte."""
+    entries = [e for e in (compact(d) for d in devices) if e is not None]
+    if not entries:
+        return 0
+    old = redis_client.hmget(DEVICES_KEY, [e["mac"] for e in entries])
+    pipe = redis_client.pipeline(transaction=False)
+    for entry, raw in zip(entries, old):
+        if raw:
+            _unindex(pipe, json.loads(raw))
+        mac = entry["mac"]
+        pipe.hset(DEVICES_KEY, mac, json.dumps(entry, separators=(",", ":")))
+        pipe.zadd(MACS_KEY, {mac: 0})
+        if entry.get("vid"):
+            pipe.sadd(VID_KEY.format(vid=entry["vid"]), mac)
+        if entry.get("role_id") is not None:
+            pipe.sadd(ROLE_KEY.format(role_id=entry["role_id"]), mac)
+    pipe.execute()
+    return len(entries)
+
+
+def remove_many(macs):
+    """Fjerner enheter (normaliserte MAC-adresser) fra indeksen."""
+    macs = list(macs)
+    if not macs:
+        return
+    old = redis_client.hmget(DEVICES_KEY, macs)
+    pipe = redis_client.pipeline(transaction=False)
+    for mac, raw in zip(macs, old):
+        if raw:
+            _unindex(pipe, json.loads(raw))
+    pipe.hdel(DEVICES_KEY, *macs)
+    pipe.zrem(MACS_KEY, *macs)
+    pipe.execute()
+
+
+def index_device(device):
+    """Oppdaterer indeksen med en enhet appen nettopp har opprettet/oppdatert. Feil logges og ignoreres."""
+    try:
+        upsert_many([device])
+    except redis.RedisError as e:
+        logger.warning(f"Kunne ikke oppdatere enhetsindeksen: {e}")
+
+
+def search(mac_prefix=None, vid=None, role_id=None, limit=50):
+    """Søker i indeksen. mac_prefix må være normalisert (normalize_mac_prefix).
+
+    Returnerer {"results": [...], "truncated": bool, "synced_at": epoch eller None}.
+    """
+    if vid or role_id is not None:
+        keys = []
+        if vid:
+            keys.append(VID_KEY.format(vid=vid))
+        if role_id is not None:
+            keys.append(ROLE_KEY.format(role_id=role_id))
+        macs = sorted(redis_client.sinter(keys))
+        if mac_prefix:
+            macs = [m for m in macs if m.startswith(mac_prefix)]
+    else:
+        macs = redis_client.zrangebylex(MACS_KEY, f"[{mac_prefix}", f"[{mac_prefix}\xff", start=0, num=limit + 1)
+    truncated = len(macs) > limit
+    macs = macs[:limit]
+    pipe = redis_client.pipeline(transaction=False)
+    if macs:
+        pipe.hmget(DEVICES_KEY, macs)
+    pipe.hget(META_KEY, "last_sync")
+    replies = pipe.execute()
+    raw_entries = replies[0] if macs else []
+    synced_at = replies[-1]
+    return {
+        "results": [json.loads(raw) for raw in raw_entries if raw],
+        "truncated": truncated,
+        "synced_at": float(synced_at) if synced_at else None,
+    }
+
+
+def _fetch_page(after_id):
+    """Henter neste side med enheter sortert på id, med id større enn after_id."""
+    params = {
+        "filter": json.dumps({"id": {"$gt": after_id}}),
+        "sort": "+id",
+        "limit": Config.INVENTORY_PAGE_SIZE,
+        "calculate_count": "false",
+    }
+    data = client.get(DEVICE_PATH, params=params).json()
+    return data.get("_embedded", {}).get("items", [])
+
+
+def _sync_from(after_id, checkpoint):
+    """Henter alle enheter med id > after_id. Med checkpoint lagres høyeste id etter hver side,
+    slik at en avbrutt inkrementell synk fortsetter der den slapp.
+    Returnerer (antall indekserte, høyeste id, MAC-adresser som ble sett).
+    """
+    count = 0
+    seen = set()
+    while True:
+        items = _fetch_page(after_id)
+        if not items:
+            break
+        count += upsert_many(items)
+        seen.update(mac for mac in (normalize_mac(i.get("mac")) for i in items) if mac)
+        after_id = max([after_id] + [int(i["id"]) for i in items if i.get("id") is not None])
+        if checkpoint:
+            redis_client.hset(META_KEY, "last_id", after_id)
+        if len(items) < Config.INVENTORY_PAGE_SIZE:
+            break
+    return count, after_id, seen
+
+
+def incremental_sync():
+    """Henter enheter som er opprettet siden forrige synk. Returnerer antall indekserte."""
+    last_id = int(redis_client.hget(META_KEY, "last_id") or 0)
+    count, _, _ = _sync_from(last_id, checkpoint=True)
+    redis_client.hset(META_KEY, "last_sync", time.time())
+    return count
+
+
+def full_sync():
+    """Går gjennom alle enheter, oppdaterer endrede og fjerner slettede. Returnerer antall indekserte."""
+    count, last_id, seen = _sync_from(0, checkpoint=False)
+    stale = set(redis_client.zrange(MACS_KEY, 0, -1)) - seen
+    remove_many(stale)
+    now = time.time()
+    redis_client.hset(META_KEY, mapping={
+        "last_id": last_id, "last_sync": now, "last_full_sync": now, "count": len(seen),
+    })
+    if stale:
+        logger.info(f"Fjernet {len(stale)} slettede enheter fra indeksen.")
+    return count
+
+
+def sync_once():
+    """Kjører én synk (full hvis det er INVENTORY_FULL_SYNC_INTERVAL siden sist, ellers inkrementell).
+    Låsen i Redis sørger for at kun én prosess synkroniserer om gangen.
+    """
+    lock = redis_client.lock(SYNC_LOCK_KEY, timeout=Config.INVENTORY_FULL_SYNC_INTERVAL)
+    if not lock.acquire(blocking=False):
+        return
+    started = time.perf_counter()
+    mode = "incremental"
+    result = "error"
+    try:
+        last_full = float(redis_client.hget(META_KEY, "last_full_sync") or 0)
+        if time.time() - last_full >= Config.INVENTORY_FULL_SYNC_INTERVAL:
+            mode = "full"
+        count = full_sync() if mode == "full" else incremental_sync()
+        result = "success"
+        logger.info(f"Synk ({mode}) av enhetsindeksen: {count} enheter på {time.perf_counter() - started:.1f} s")
+    finally:
+        metrics.INVENTORY_SYNC_DURATION.labels(mode, result).observe(time.perf_counter() - started)
+        try:
+            lock.release()
+        except redis.exceptions.LockError:
+            pass
+
+
+def run():
+    """Hovedløkke for synkronisering av enhetsindeksen."""
+    logger.info("Synkronisering av enhetsindeksen startet.")
+    while True:
+        try:
+            sync_once()
+        except (ClearPassError, redis.RedisError) as e:
+            logger.error(f"Synk av enhetsindeksen feilet: {e}")
+        time.sleep(Config.INVENTORY_SYNC_INTERVAL)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    run()
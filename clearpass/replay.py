@@ -0,0 +1,222 @@
+"""
+Kø for opprettelser og oppdateringer som ikke kunne sendes fordi circuit breakeren var åpen.
+Endringene legges i en liste i Redis og sendes i rekkefølge av python -m clearpass.replay
+(startes av supervisord) når ClearPass svarer igjen. Kun kall som aldri ble sendt havner i køen,
+så en opprettelse kan ikke bli utført to ganger. Endringer ClearPass avviser (4xx), eller som
+feiler REPLAY_MAX_ATTEMPTS ganger, flyttes til en egen liste og logges. Sendte og avviste endringer
+registreres i revisjonsloggen med source "replay".
+
+Antall køede endringer per MAC telles i en hash. Så lenge en MAC har køede endringer, legges også nye
+endringer for den i køen (se api.py), slik at en eldre køet oppdatering ikke overskriver en nyere.
+Hver endring har en id som merkes som sendt i samme operasjon som den fjernes fra køen. Feiler
+fjerningen, hoppes endringen over i neste runde i stedet for å sendes på nytt.
+"""
+import json
+import logging
+import time
+import uuid
+
+import redis
+
+from config import Config
+from utils import metrics
+from utils.redis import redis_client
+from . import audit, breaker, client, device_cache, inventory
+from .client import CircuitOpenError, ClearPassAuthError, ClearPassError
+from .utils import normalize_mac
+
+logger = logging.getLogger("replay")
+
+QUEUE_KEY = "clearpass:replay"
+FAILED_KEY = "clearpass:replay:failed"
+LOCK_KEY = "clearpass:replay:lock"
+PENDING_KEY = "clearpass:replay:pending"
+DONE_KEY = "clearpass:replay:done:{id}"
+DONE_TTL = 7 * 86400  # Hvor lenge id-en til en sendt endring huskes
+FAILED_MAX = 1000  # Antall avviste endringer som beholdes for feilsøking
+
+# Fjerner hodet av køen, merker det som ferdig og teller ned køede endringer for MAC-adressen.
+# KEYS: kø, tellere per MAC, ferdig-nøkkel. ARGV: MAC-nøkkel, TTL for ferdig-nøkkelen.
+_FINISH = redis_client.register_script("""
+redis.call('LPOP', KEYS[1])
+redis.call('SET', KEYS[3], '1', 'EX', ARGV[2])
+if redis.call('HINCRBY', KEYS[2], ARGV[1], -1) <= 0 then
+    redis.call('HDEL', KEYS[2], ARGV[1])
+end
+if redis.call('LLEN', KEYS[1]) == 0 then
+    redis.call('DEL', KEYS[2])
+end
+return 1
+""")
+
+
+def _mac_key(mac):
+    return normalize_mac(mac) or str(mac).lower()
+
+
+def enqueue(operation, mac, payload, user_email):
+    """Legger en endring i køen. Returnerer oppføringen (med id), eller None hvis Redis er utilgjengelig."""
+    entry = {
+        "id": uuid.uuid4().hex,
+        "operation": operation,
+        "mac": mac,
+        "payload": payload,
+        "user": user_email,
+        "queued_at": time.time(),
+        "attempts": 0,
+    }
+    try:
+        pipe = redis_client.pipeline()
+        pipe.rpush(QUEUE_KEY, json.dumps(entry))
+        pipe.hincrby(PENDING_KEY, _mac_key(mac), 1)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.error(f"Kunne ikke legge endring i kø: {e}")
+        return None
+    logger.info(f"{operation} av {mac} lagt i kø ({entry['id']})")
+    return entry
+
+
+def has_pending(mac):
+    """True hvis MAC-adressen har køede endringer som ikke er sendt (False hvis Redis er utilgjengelig)."""
+    try:
+        return bool(redis_client.hexists(PENDING_KEY, _mac_key(mac)))
+    except redis.RedisError as e:
+        logger.warning(f"Kunne ikke sjekke køen for {mac}: {e}")
+        return False
+
+
+def pending():
+    """Antall endringer som venter i køen (0 hvis Redis er utilgjengelig)."""
+    try:
+        return redis_client.llen(QUEUE_KEY)
+    except redis.RedisError:
+        return 0
+
+
+def _send(entry):
+    """Sender én endring til ClearPass og oppdaterer cache, enhetsindeks og revisjonslogg.
+    Feil etter at ClearPass har tatt imot endringen logges i stedet for å kastes, slik at den ikke sendes på nytt.
+    """
+    mac = entry["mac"]
+    started = time.perf_counter()
+    if entry["operation"] == "create":
+        resp = client.post("/api/device", json=entry["payload"])
+    else:
+        resp = client.patch(f"/api/device/mac/{mac}", json=entry["payload"])
+    latency_ms = (time.perf_counter() - started) * 1000
+    try:
+        _applied(entry, resp, latency_ms)
+    except Exception:
+        logger.exception(f"Oppdatering av cache etter køet {entry['operation']} av {mac} feilet")
+
+
+def _applied(entry, resp, latency_ms):
+    mac = entry["mac"]
+    try:
+        device = resp.json()
+    except ValueError:
+        device = None
+    normalized = normalize_mac(mac)
+    previous = device_cache.write_through(normalized, device) if normalized is not None else None
+    if isinstance(device, dict) and device:
+        inventory.index_device(dict(device, mac=device.get("mac") or mac))
+    audit.record(entry["operation"], mac, entry["user"], entry["payload"], audit.RESULT_SUCCESS,
+                 previous=previous, after=device, latency_ms=latency_ms, source="replay")
+
+
+def _finish(entry, pipe=None):
+    """Fjerner hodet av køen og merker endringen som ferdig (sendt eller gitt opp)."""
+    _FINISH(keys=[QUEUE_KEY, PENDING_KEY, DONE_KEY.format(id=entry["id"])],
+            args=[_mac_key(entry["mac"]), DONE_TTL], client=pipe)
+
+
+def _give_up(entry, reason):
+    """Flytter hodet av køen til listen over avviste endringer."""
+    entry["error"] = reason
+    pipe = redis_client.pipeline()
+    _finish(entry, pipe)
+    pipe.lpush(FAILED_KEY, json.dumps(entry))
+    pipe.ltrim(FAILED_KEY, 0, FAILED_MAX - 1)
+    pipe.execute()
+    metrics.CLEARPASS_REPLAYS.labels(entry["operation"], "failed").inc()
+    audit.record(entry["operation"], entry["mac"], entry["user"], entry["payload"], audit.RESULT_ERROR,
+                 error=reason, source="replay")
+    logger.error(f"Ga opp {entry['operation']} av {entry['mac']} ({entry['id']}, {entry['user']}): {reason}")
+
+
+def _retry_later(entry, reason):
+    """Teller et mislykket forsøk på hodet av køen. Gir opp etter REPLAY_MAX_ATTEMPTS forsøk."""
+    entry["attempts"] += 1
+    if entry["attempts"] >= Config.REPLAY_MAX_ATTEMPTS:
+        _give_up(entry, reason)
+        return
+    redis_client.lset(QUEUE_KEY, 0, json.dumps(entry))
+    metrics.CLEARPASS_REPLAYS.labels(entry["operation"], "retry").inc()
+
+
+def replay_pending():
+    """Sender køede endringer i rekkefølge til køen er tom eller ClearPass feiler. Returnerer antall sendt.
+    Låsen i Redis sørger for at kun én prosess sender om gangen, slik at rekkefølgen beholdes.
+    """
+    lock = redis_client.lock(LOCK_KEY, timeout=60)
+    if not lock.acquire(blocking=False):
+        return 0
+    sent = 0
+    try:
+        while True:
+            raw = redis_client.lindex(QUEUE_KEY, 0)
+            if raw is None:
+                break
+            lock.reacquire()
+            entry = json.loads(raw)
+            if redis_client.exists(DONE_KEY.format(id=entry["id"])):
+                # Sendt tidligere, men ble ikke fjernet fra køen
+                logger.warning(f"Hopper over allerede sendt {entry['operation']} av {entry['mac']} ({entry['id']})")
+                _finish(entry)
+                continue
+            try:
+                _send(entry)
+            except (CircuitOpenError, ClearPassAuthError) as e:
+                if isinstance(e, ClearPassAuthError) and not e.unavailable:
+                    logger.error(f"Kan ikke sende køede endringer: {e}")
+                break
+            except ClearPassError as e:
+                if not e.unavailable:
+                    _give_up(entry, str(e))
+                    continue
+                _retry_later(entry, str(e))
+                break
+            except Exception as e:
+                logger.exception(f"Uventet feil ved sending av {entry['operation']} av {entry['mac']} ({entry['id']})")
+                _retry_later(entry, str(e))
+                break
+            _finish(entry)
+            sent += 1
+            metrics.CLEARPASS_REPLAYS.labels(entry["operation"], "success").inc()
+            logger.info(f"Sendte køet {entry['operation']} av {entry['mac']} ({entry['id']})")
+    finally:
+        try:
+            lock.release()
+        except redis.exceptions.LockError:
+            pass
+    return sent
+
+
+def run():
+    """Hovedløkke: sender køen når den ikke er tom og breakeren slipper kall gjennom."""
+    logger.info("Sending av køede ClearPass-endringer startet.")
+    while True:
+        try:
+            if redis_client.llen(QUEUE_KEY) and breaker.status()["state"] != breaker.OPEN:
+                replay_pending()
+        except redis.RedisError as e:
+            logger.error(f"Sending av køede endringer feilet: {e}")
+        except Exception:
+            logger.exception("Uventet feil ved sending av køede endringer")
+        time.sleep(Config.REPLAY_INTERVAL)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    run()
@@ -0,0 +1,218 @@
+"""
+Cache for ClearPass role-mapping ([Guest Roles]).
+Regellisten (name/role_id) lagres i Redis med TTL og stale-while-revalidate: når cachen er
+utløpt, men innenfor stale-vinduet, returneres gammel verdi mens en bakgrunnstråd henter ny.
+Filtrerte resultater per rollesett lagres i en egen hash slik at et oppslag er ett Redis-kall.
+Siste kjente regelliste lagres i tillegg uten TTL og serveres når ClearPass er utilgjengelig. Den
+slettes bare når en administrator tømmer cachen (invalidate).
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+
+import redis
+
+from config import Config
+from utils import metrics
+from utils.redis import redis_client
+from . import client, singleflight
+from .client import ClearPassError
+
+logger = logging.getLogger(__name__)
+
+ROLE_MAPPING_PATH = "/api/role-mapping/name/[Guest Roles]"
+RULES_KEY = "clearpass:role_mapping"
+FILTERED_KEY = "clearpass:role_mapping:filtered"
+LAST_KNOWN_KEY = "clearpass:role_mapping:last_known"
+REFRESH_LOCK_KEY = "clearpass:role_mapping:refresh"
+FETCHED_AT_FIELD = "_fetched_at"
+
+
+def parse_rules(data):
+    """Trekker ut name/role_id-par fra role-mapping-responsen til ClearPass."""
+    rules = data.get("rules") if isinstance(data, dict) else data
+    if rules is None:
+        rules = []
+    parsed = []
+    for rule in rules:
+        role_name = rule.get("role_name") or rule.get("name")
+        role_id = None
+        if "role_id" in rule:
+            role_id = str(rule["role_id"])
+        else:
+            conditions = rule.get("condition", [])
+            for cond in conditions:
+                if isinstance(cond, dict) and "value" in cond:
+                    role_id = str(cond["value"])
+                    break
+        if role_name and role_id:
+            parsed.append({"name": role_name, "role_id": role_id})
+    return parsed
+
+
+def filter_rules(rules, allowed_role_ids):
+    """Returnerer reglene brukeren har tilgang til. Tomt sett betyr ingen begrensning."""
+    return [r for r in rules if not allowed_role_ids or r["role_id"] in allowed_role_ids]
+
+
+def _role_set_digest(allowed_role_ids):
+    """Stabil nøkkel for et rollesett."""
+    joined = ",".join(sorted(allowed_role_ids)) or "*"
+    return hashlib.sha1(joined.encode()).hexdigest()
+
+
+def _store(rules):
+    """Lagrer nye regler og nullstiller filtrerte resultater i én transaksjon."""
+    fetched_at = time.time()
+    ttl = Config.ROLE_MAPPING_CACHE_TTL + Config.ROLE_MAPPING_STALE_TTL
+    entry = json.dumps({"rules": rules, "fetched_at": fetched_at})
+    pipe = redis_client.pipeline()
+    pipe.set(RULES_KEY, entry, ex=ttl)
+    pipe.set(LAST_KNOWN_KEY, entry)
+    pipe.delete(FILTERED_KEY)
+    pipe.hset(FILTERED_KEY, FETCHED_AT_FIELD, fetched_at)
+    pipe.expire(FILTERED_KEY, ttl)
+    pipe.execute()
+    return fetched_at
+
+
+def refresh():
+    """Henter regler fra ClearPass og oppdaterer cachen. Returnerer (rules, fetched_at).
+    Samtidige kall deler én henting fra ClearPass.
+    """
+    return singleflight.do("role_mapping", ROLE_MAPPING_PATH, _fetch_and_store)
+
+
+def _fetch_and_store():
+    rules = parse_rules(client.get(ROLE_MAPPING_PATH).json())
+    try:
+        fetched_at = _store(rules)
+    except redis.RedisError as e:
+        logger.warning(f"Kunne ikke lagre role-mapping i Redis: {e}")
+        fetched_at = time.time()
+    return rules, fetched_at
+
+
+def _refresh_in_background():
+    """Starter revalidering i bakgrunnen hvis ingen annen worker allerede gjør det."""
+    try:
+        if not redis_client.set(REFRESH_LOCK_KEY, "1", nx=True, ex=int(Config.CLEARPASS_READ_TIMEOUT * 3)):
+            return
+    except redis.RedisError:
+        return
+
+    def run():
+        try:
+            refresh()
+        except Exception as e:
+            logger.warning(f"Bakgrunnsoppdatering av role-mapping feilet: {e}")
+        finally:
+            try:
+                redis_client.delete(REFRESH_LOCK_KEY)
+            except redis.RedisError:
+                pass
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def _is_fresh(fetched_at, now):
+    """Cachen er fersk innenfor ROLE_MAPPING_CACHE_TTL."""
+    return now - fetched_at < Config.ROLE_MAPPING_CACHE_TTL
+
+
+def _is_usable(fetched_at, now):
+    """Cachen kan serveres (eventuelt utdatert) innenfor TTL + stale-vinduet."""
+    return now - fetched_at < Config.ROLE_MAPPING_CACHE_TTL + Config.ROLE_MAPPING_STALE_TTL
+
+
+def _last_known():
+    """Returnerer (rules, fetched_at) for siste kjente regelliste, eller None."""
+    try:
+        raw = redis_client.get(LAST_KNOWN_KEY)
+    except redis.RedisError as e:
+        logger.warning(f"Kunne ikke lese siste kjente role-mapping fra Redis: {e}")
+        return None
+    if not raw:
+        return None
+    entry = json.loads(raw)
+    return entry["rules"], entry["fetched_at"]
+
+
+def get_rules():
+    """Returnerer (rules, fetched_at) fra cache, eller fra ClearPass hvis cachen mangler/er for gammel.
+    Er ClearPass utilgjengelig, returneres siste kjente regelliste (fetched_at viser alderen).
+    """
+    try:
+        raw = redis_client.get(RULES_KEY)
+    except redis.RedisError as e:
+        logger.warning(f"Kunne ikke lese role-mapping fra Redis: {e}")
+        raw = None
+    if raw:
+        entry = json.loads(raw)
+        now = time.time()
+        if _is_fresh(entry["fetched_at"], now):
+            metrics.CACHE_REQUESTS.labels("role_mapping_rules", "hit").inc()
+            return entry["rules"], entry["fetched_at"]
+        if _is_usable(entry["fetched_at"], now):
+            metrics.CACHE_REQUESTS.labels("role_mapping_rules", "stale").inc()
+            _refresh_in_background()
+            return entry["rules"], entry["fetched_at"]
+    metrics.CACHE_REQUESTS.labels("role_mapping_rules", "miss").inc()
+    try:
+        return refresh()
+    except ClearPassError as e:
+        last_known = _last_known() if e.unavailable else None
+        if last_known is None:
+            raise
+        logger.warning(f"ClearPass utilgjengelig ({e}), serverer siste kjente role-mapping.")
+        metrics.CACHE_REQUESTS.labels("role_mapping_rules", "fallback").inc()
+        return last_known
+
+
+def get_roles_for(allowed_role_ids):
+    """Returnerer (roles, stale) for et rollesett, normalt med ett enkelt Redis-kall.
+    stale er True når rollene kommer fra siste kjente regelliste fordi ClearPass er utilgjengelig.
+    """
+    digest = _role_set_digest(allowed_role_ids)
+    try:
+        fetched_at, cached = redis_client.hmget(FILTERED_KEY, FETCHED_AT_FIELD, digest)
+    except redis.RedisError as e:
+        logger.warning(f"Kunne ikke lese filtrerte roller fra Redis: {e}")
+        fetched_at, cached = None, None
+    if fetched_at and cached:
+        fetched_at = float(fetched_at)
+        entry = json.loads(cached)
+        now = time.time()
+        # Resultatet må være beregnet fra gjeldende regelsett
+        if entry.get("fetched_at") == fetched_at and _is_usable(fetched_at, now):
+            if _is_fresh(fetched_at, now):
+                metrics.CACHE_REQUESTS.labels("role_mapping", "hit").inc()
+            else:
+                metrics.CACHE_REQUESTS.labels("role_mapping", "stale").inc()
+                _refresh_in_background()
+            return entry["roles"], False
+    metrics.CACHE_REQUESTS.labels("role_mapping", "miss").inc()
+    rules, rules_fetched_at = get_rules()
+    roles = filter_rules(rules, allowed_role_ids)
+    if not _is_usable(rules_fetched_at, time.time()):
+        # Siste kjente regelliste: caches ikke som filtrert resultat
+        return roles, True
+    try:
+        redis_client.hset(FILTERED_KEY, digest, json.dumps({"roles": roles, "fetched_at": rules_fetched_at}))
+    except redis.RedisError as e:
+        logger.warning(f"Kunne ikke lagre filtrerte roller i Redis: {e}")
+    return roles, False
+
+
+def invalidate():
+    """Tømmer cachen, også siste kjente regelliste, slik at neste oppslag henter role-mapping direkte
+    fra ClearPass og utdaterte roller ikke kan serveres senere. Returnerer False hvis Redis feilet.
+    """
+    try:
+        redis_client.delete(RULES_KEY, FILTERED_KEY, LAST_KNOWN_KEY)
+    except redis.RedisError as e:
+        logger.error(f"Kunne ikke tømme role-mapping-cachen i Redis: {e}")
+        return False
+    return True
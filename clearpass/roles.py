@@ -1,49 +1,110 @@
 """
 Rolle- og domenehåndtering for CP-Tekniker Device Management App.
-Gir funksjoner for å laste godkjente domener/e-poster og finne roller for en bruker.
+Holder en indeks over approved_domains.json i minnet (lastes én gang per worker og lastes
+på nytt automatisk når filen endres), og gir oppslag for godkjenning og roller for en bruker.
+Kan filen ikke leses, beholdes forrige indeks, og feilen logges én gang per endring av filen.
 """
 import os
 import json
+import logging
+import threading
+import time
 
-def load_approved_domains_and_emails():
-    """Laster approved_domains.json og returnerer to lister: godkjente domener og godkjente e-poster."""
-    approved_path = os.path.join(
-        os.path.dirname(os.path.abspath(__file__)), "..", "approved_domains.json"
-    )
-    try:
-        with open(approved_path, "r") as f:
-            domain_data = json.load(f)
-        approved_domains = []
-        approved_emails = []
-        for entry in domain_data:
-            if "@" in entry["email"]:
-                approved_emails.append(entry["email"].lower())
-            else:
-                approved_domains.append(entry["email"].lower())
-        return approved_domains, approved_emails
-    except Exception as e:
-        print(f"Kunne ikke laste godkjente domener: {e}")
-        return [], []
-
-def get_user_roles(email, full_domain_data=None):
-    """Returnerer roller for en gitt e-post basert på eksakt match eller domenematch.
-    full_domain_data kan sendes inn for å unngå fil-I/O hvis allerede lastet.
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_MISSING = -1  # mtime når filen ikke finnes eller ikke kan leses
+
+
+class ApprovedDomainsIndex:
+    """Indeks over godkjente e-poster og domener med tilhørende roller.
+
+    Eksakte e-poster ligger i et hash-oppslag. Domener slås opp ved å gå gjennom
+    domenets etiketter fra mest til minst spesifikk, slik at oppføringen "firma.no"
+    også gjelder "butikk.firma.no". Eksakt e-post har alltid høyest prioritet.
     """
-    email = email.lower()
-    if full_domain_data is None:
-        approved_path = os.path.join(
-            os.path.dirname(os.path.abspath(__file__)), "..", "approved_domains.json"
-        )
+
+    def __init__(self, path, check_interval=2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked_at = float("-inf")
+        self._emails = {}
+        self._domains = {}
+
+    def _load(self, mtime):
+        """Leser filen og bygger nye oppslag. Ved feil beholdes forrige indeks.
+        mtime huskes også ved feil, slik at samme ødelagte fil ikke leses på nytt før den endres.
+        """
+        self._mtime = mtime
         try:
-            with open(approved_path, "r") as f:
-                full_domain_data = json.load(f)
+            with open(self.path, "r") as f:
+                domain_data = json.load(f)
+            emails = {}
+            domains = {}
+            for entry in domain_data:
+                key = entry["email"].strip().lower()
+                target = emails if "@" in key else domains
+                # Første oppføring vinner, som ved lineært søk
+                target.setdefault(key, entry.get("roles", []))
         except Exception as e:
-            print(f"Kunne ikke laste godkjente domener for roller: {e}")
-            return []
-    for entry in full_domain_data:
-        if email == entry["email"]:
-            return entry.get("roles", [])
-    for entry in full_domain_data:
-        if email.endswith("@" + entry["email"]):
-            return entry.get("roles", [])
-    return []
+            logger.error(f"Kunne ikke laste godkjente domener fra {self.path}: {e}")
+            return
+        self._emails, self._domains = emails, domains
+
+    def _maybe_reload(self):
+        """Sjekker filens mtime høyst hvert check_interval sekund og laster på nytt ved endring."""
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError as e:
+                if self._mtime != _MISSING:
+                    logger.error(f"Kunne ikke lese godkjente domener: {e}")
+                    self._mtime = _MISSING
+                return
+            if mtime != self._mtime:
+                self._load(mtime)
+
+    def lookup(self, email):
+        """Returnerer rollelisten for e-posten, eller None hvis den ikke er godkjent."""
+        self._maybe_reload()
+        email = email.strip().lower()
+        roles = self._emails.get(email)
+        if roles is not None:
+            return roles
+        local, sep, domain = email.partition("@")
+        if not local or not sep or not domain or "@" in domain:
+            return None
+        domains = self._domains
+        labels = domain.split(".")
+        for i in range(len(labels)):
+            roles = domains.get(".".join(labels[i:]))
+            if roles is not None:
+                return roles
+        return None
+
+    def preload(self):
+        """Laster indeksen med én gang i stedet for ved første oppslag."""
+        self._maybe_reload()
+
+    def is_approved(self, email):
+        """Sjekker om e-post er godkjent basert på eksakt match eller domenematch."""
+        return self.lookup(email) is not None
+
+
+approved_index = ApprovedDomainsIndex(
+    Config.APPROVED_DOMAINS_FILE, Config.APPROVED_DOMAINS_CHECK_INTERVAL
+)
+
+
+def get_user_roles(email):
+    """Returnerer roller for en gitt e-post basert på eksakt match eller domenematch."""
+    return approved_index.lookup(email) or []
@@ -1,11 +1,18 @@
 """
-Blueprint for ClearPass-tilleggsruter (roller).
-Eksponerer endepunkt for å hente kun de rollene brukeren har tilgang til.
+Blueprint for ClearPass-tilleggsruter (roller, enhetssøk og revisjonslogg).
+Eksponerer endepunkt for å hente kun de rollene brukeren har tilgang til, for å tømme rollecachen,
+for å søke i den lokale enhetsindeksen (clearpass/inventory.py) og for å slå opp i revisjonsloggen
+(clearpass/audit.py).
 """
-from flask import Blueprint, jsonify, session
-from .api import get_cached_token
-import requests
-from .roles import load_approved_domains_and_emails, get_user_roles
+import redis
+from flask import Blueprint, jsonify, request, session, current_app as app
+from config import Config
+from auth.limiter import limiter
+from . import audit, inventory, role_cache
+from .api import _unavailable_response, _validate_vid_format
+from .client import CircuitOpenError, ClearPassAuthError
+from .roles import get_user_roles
+from .utils import normalize_mac, normalize_mac_prefix
 
 bp = Blueprint('clearpass_routes', __name__)
 
@@ -14,46 +21,86 @@ def get_device_roles():
     """API-endepunkt som returnerer kun de rollene brukeren har tilgang til (basert på e-post/domene)."""
     if not session.get("logged_in") or not session.get("session_token"):
         return jsonify({"error": "Autentisering kreves."}), 401
-    token = get_cached_token()
-    if not token:
-        return jsonify({"error": "Autentisering feilet."}), 500
-    headers = {"Authorization": f"Bearer {token}"}
-    from config import Config
-    api_url = f"{Config.BASE_URL}/api/role-mapping/name/[Guest Roles]"
     try:
-        resp = requests.get(api_url, headers=headers)
-        resp.raise_for_status()
-        data = resp.json()
-        import os, json
-        approved_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "approved_domains.json")
-        with open(approved_path, "r") as f:
-            full_domain_data = json.load(f)
         user_email = session.get("user_email", "").lower()
-        allowed_roles = get_user_roles(user_email, full_domain_data)
+        allowed_roles = get_user_roles(user_email)
         allowed_role_ids = {str(r["role_id"]) for r in allowed_roles}
-        roles = []
-        rules = data.get("rules") if isinstance(data, dict) else data
-        if rules is None:
-            rules = []
-        for rule in rules:
-            role_name = rule.get("role_name") or rule.get("name")
-            role_id = None
-            if "role_id" in rule:
-                role_id = str(rule["role_id"])
-            else:
-                conditions = rule.get("condition", [])
-                for cond in conditions:
-                    if isinstance(cond, dict) and "value" in cond:
-                        role_id = str(cond["value"])
-                        break
-            if (
-                role_name
-                and role_id
-                and (not allowed_role_ids or role_id in allowed_role_ids)
-            ):
-                roles.append({"name": role_name, "role_id": role_id})
-        return jsonify(roles), 200
+        roles, stale = role_cache.get_roles_for(allowed_role_ids)
+        response = jsonify(roles)
+        if stale:
+            # ClearPass er utilgjengelig: siste kjente roller
+            response.headers["Warning"] = '110 - "Response is Stale"'
+        return response, 200
+    except CircuitOpenError:
+        return _unavailable_response()
+    except ClearPassAuthError:
+        return jsonify({"error": "Autentisering feilet."}), 500
     except Exception as e:
-        from flask import current_app as app
         app.logger.error(f"API-forespørsel feilet: {e}")
         return jsonify({"error": "Kunne ikke hente enhetsroller."}), 500
+
+@bp.route('/GetDeviceRoles/invalidate', methods=['POST'])
+def invalidate_device_roles():
+    """API-endepunkt for administratorer som tømmer role-mapping-cachen."""
+    if not session.get("logged_in") or not session.get("session_token"):
+        return jsonify({"error": "Autentisering kreves."}), 401
+    if session.get("user_email", "").lower() not in Config.ADMIN_EMAILS:
+        return jsonify({"error": "Krever administratortilgang."}), 403
+    if not role_cache.invalidate():
+        return jsonify({"error": "Kunne ikke tømme rollecachen."}), 503
+    return jsonify({"message": "Rollecache tømt."}), 200
+
+@bp.route('/devices/search', methods=['GET'])
+@limiter.limit("60 per minute")
+def search_devices():
+    """API-endepunkt for søk i enhetsindeksen med MAC-prefiks og/eller VirksomhetsID og rolle (krever innlogging)."""
+    if not session.get("logged_in") or not session.get("session_token"):
+        return jsonify({"error": "Autentisering kreves."}), 401
+    mac = request.args.get("mac", "").strip()
+    vid = request.args.get("vid", "").strip()
+    role_id = request.args.get("role_id", "").strip()
+    if not mac and not vid and not role_id:
+        return jsonify({"error": "Oppgi MAC-prefiks, VirksomhetsID eller rolle."}), 400
+    mac_prefix = normalize_mac_prefix(mac) if mac else None
+    if mac and mac_prefix is None:
+        return jsonify({"error": "Ugyldig MAC-prefiks."}), 400
+    if vid and not _validate_vid_format(vid):
+        return jsonify({"error": "VirksomhetsID må være 5 tall (f.eks. 12345)."}), 400
+    try:
+        limit = min(max(int(request.args.get("limit", 50)), 1), Config.SEARCH_MAX_RESULTS)
+    except ValueError:
+        return jsonify({"error": "limit må være et tall."}), 400
+    try:
+        result = inventory.search(mac_prefix, vid or None, role_id or None, limit)
+    except redis.RedisError as e:
+        app.logger.error(f"Søk i enhetsindeksen feilet: {e}")
+        return jsonify({"error": "Kunne ikke søke i enhetsoversikten."}), 500
+    return jsonify(result), 200
+
+@bp.route('/audit', methods=['GET'])
+@limiter.limit("60 per minute")
+def audit_log():
+    """API-endepunkt for endringshistorikk per MAC-adresse eller bruker (krever innlogging).
+    Alle kan slå opp en MAC-adresse og sin egen historikk; andres historikk krever administratortilgang.
+    """
+    if not session.get("logged_in") or not session.get("session_token"):
+        return jsonify({"error": "Autentisering kreves."}), 401
+    mac = request.args.get("mac", "").strip()
+    user = request.args.get("user", "").strip().lower()
+    if bool(mac) == bool(user):
+        return jsonify({"error": "Oppgi enten mac eller user."}), 400
+    if mac and normalize_mac(mac) is None:
+        return jsonify({"error": "Ugyldig MAC-adresse."}), 400
+    if user and user != session.get("user_email", "").lower() and \
+            session.get("user_email", "").lower() not in Config.ADMIN_EMAILS:
+        return jsonify({"error": "Krever administratortilgang."}), 403
+    try:
+        limit = min(max(int(request.args.get("limit", 50)), 1), Config.AUDIT_INDEX_MAX)
+    except ValueError:
+        return jsonify({"error": "limit må være et tall."}), 400
+    try:
+        events = audit.query(mac=mac or None, user=user or None, limit=limit)
+    except redis.RedisError as e:
+        app.logger.error(f"Oppslag i revisjonsloggen feilet: {e}")
+        return jsonify({"error": "Kunne ikke hente endringshistorikk."}), 500
+    return jsonify({"events": events}), 200
@@ -0,0 +1,132 @@
+"""
+Single-flight for lesekall mot ClearPass.
+Samtidige identiske kall (samme nøkkel) deler ett kall mot ClearPass: innenfor en worker venter
+de andre trådene/greenletene på resultatet fra den første. Med SINGLEFLIGHT_SHARED=true deles
+kallet også på tvers av workere via en kort Redis-lås og en resultatnøkkel per kall. Ventende
+prosesser leser kun resultatet fra kallet som pågikk da de kom, så det gir ingen ekstra foreldelse.
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+
+import redis
+
+from config import Config
+from utils import metrics
+from utils.redis import redis_client
+
+logger = logging.getLogger(__name__)
+
+LOCK_KEY = "singleflight:{key}:lock"
+RESULT_KEY = "singleflight:{key}:result:{token}"
+RESULT_TTL = 5  # Sekunder resultatet ligger i Redis for ventende workere
+POLL_INTERVAL = 0.02
+
+# Sletter låsen kun hvis den fortsatt tilhører dette kallet
+_RELEASE = redis_client.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+
+class _Call:
+    """Et pågående kall som andre tråder kan vente på."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_calls = {}
+_calls_lock = threading.Lock()
+
+
+def _encode(value):
+    return json.dumps({"value": value, "tuple": isinstance(value, tuple)})
+
+
+def _decode(raw):
+    entry = json.loads(raw)
+    return tuple(entry["value"]) if entry["tuple"] else entry["value"]
+
+
+def _shared(name, key, fn):
+    """Deler kallet mellom workere. Faller tilbake til et vanlig kall hvis Redis feiler."""
+    token = uuid.uuid4().hex
+    lock_key = LOCK_KEY.format(key=key)
+    try:
+        acquired = redis_client.set(lock_key, token, nx=True, ex=Config.SINGLEFLIGHT_LOCK_TTL)
+        owner = None if acquired else redis_client.get(lock_key)
+    except redis.RedisError as e:
+        logger.warning(f"Single-flight-lås utilgjengelig: {e}")
+        return fn()
+
+    if owner is None:
+        # Vi eier låsen (eller den ble nettopp frigitt): gjør kallet selv
+        try:
+            result = fn()
+            try:
+                redis_client.set(RESULT_KEY.format(key=key, token=token), _encode(result), ex=RESULT_TTL)
+            except (redis.RedisError, TypeError, ValueError) as e:
+                logger.warning(f"Kunne ikke dele single-flight-resultat: {e}")
+            return result
+        finally:
+            try:
+                _RELEASE(keys=[lock_key], args=[token])
+            except redis.RedisError:
+                pass
+
+    # En annen worker gjør kallet: vent på resultatet fra akkurat det kallet
+    result_key = RESULT_KEY.format(key=key, token=owner)
+    deadline = time.monotonic() + Config.SINGLEFLIGHT_LOCK_TTL
+    try:
+        while time.monotonic() < deadline:
+            raw = redis_client.get(result_key)
+            if raw is not None:
+                metrics.SINGLEFLIGHT_CALLS.labels(name, "shared_redis").inc()
+                return _decode(raw)
+            if redis_client.get(lock_key) != owner:
+                # Kallet feilet eller resultatet kunne ikke deles
+                break
+            time.sleep(POLL_INTERVAL)
+    except redis.RedisError as e:
+        logger.warning(f"Kunne ikke lese single-flight-resultat: {e}")
+    return fn()
+
+
+def do(name, key, fn):
+    """Kjører fn() én gang for alle samtidige kall med samme nøkkel og returnerer resultatet.
+
+    name grupperer nøklene i metrikker (f.eks. "device"). Unntak fra fn() kastes til alle som venter.
+    Med SINGLEFLIGHT_SHARED må resultatet kunne serialiseres som JSON.
+    """
+    full_key = f"{name}:{key}"
+    with _calls_lock:
+        call = _calls.get(full_key)
+        leader = call is None
+        if leader:
+            call = _calls[full_key] = _Call()
+
+    if not leader:
+        metrics.SINGLEFLIGHT_CALLS.labels(name, "shared_local").inc()
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    metrics.SINGLEFLIGHT_CALLS.labels(name, "leader").inc()
+    try:
+        call.result = _shared(name, full_key, fn) if Config.SINGLEFLIGHT_SHARED else fn()
+        return call.result
+    except Exception as e:
+        call.error = e
+        raise
+    finally:
+        with _calls_lock:
+            _calls.pop(full_key, None)
+        call.done.set()
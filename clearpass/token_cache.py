@@ -0,0 +1,230 @@
+"""
+Delt token-cache for ClearPass OAuth.
+Access token lagres i Redis slik at alle gunicorn-workere bruker samme token, og en
+Redis-lås sørger for at kun én prosess fornyer tokenet om gangen. Hver worker holder
+i tillegg en lokal kopi, slik at vanlige forespørsler aldri trenger å gå mot Redis.
+Proaktiv fornying (tokenet er fortsatt gyldig) gjøres i en bakgrunnstråd uten å vente på låsen,
+så forespørselen bruker det gjeldende tokenet. Kun når det ikke finnes et gyldig token, venter
+forespørselen på fornyingen.
+"""
+import contextlib
+import json
+import logging
+import threading
+import time
+
+import redis
+from flask import current_app as app, has_app_context
+
+from config import Config
+from utils import metrics
+from utils.redis import redis_client
+
+TOKEN_KEY = "clearpass:token"
+LOCK_KEY = "clearpass:token:lock"
+
+# Lokal kopi av tokenet (per worker). expiry og refresh_at er epoch-sekunder.
+_local = {"token": None, "expiry": 0.0, "refresh_at": 0.0}
+# HTTP-status fra siste mislykkede henting av token, None når /api/oauth ikke kunne nås eller svarte ugyldig
+_last_failure = {"status": None}
+_refresh_lock = threading.Lock()
+
+
+def _logger():
+    """Appens logger, eller modulens logger utenfor app-kontekst (python -m clearpass.replay m.fl.)."""
+    return app.logger if has_app_context() else logging.getLogger(__name__)
+
+
+def _is_fresh(entry, now):
+    """Tokenet er ferskt frem til tidspunktet for proaktiv fornying."""
+    return bool(entry.get("token")) and entry.get("refresh_at", 0) > now
+
+
+def _is_valid(entry, now):
+    """Tokenet kan fortsatt brukes (men bør kanskje fornyes)."""
+    return bool(entry.get("token")) and entry.get("expiry", 0) > now
+
+
+def _read_shared():
+    """Leser delt token fra Redis. Returnerer None hvis det mangler eller Redis er utilgjengelig."""
+    try:
+        raw = redis_client.get(TOKEN_KEY)
+    except redis.RedisError as e:
+        _logger().warning(f"Kunne ikke lese token fra Redis: {e}")
+        return None
+    if not raw:
+        return None
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return None
+
+
+def _write_shared(entry, ttl):
+    """Lagrer token i Redis med TTL lik gjenværende levetid."""
+    try:
+        redis_client.set(TOKEN_KEY, json.dumps(entry), ex=max(int(ttl), 1))
+    except redis.RedisError as e:
+        _logger().warning(f"Kunne ikke lagre token i Redis: {e}")
+
+
+def _fetch_token():
+    """Henter nytt access token fra ClearPass. Returnerer (entry, ttl) eller (None, 0)."""
+    # Importeres her for å unngå sirkulær import (klienten bruker token-cachen)
+    from .client import get_session, get_timeout
+    token_url = f"{Config.BASE_URL}/api/oauth"
+    started = time.perf_counter()
+    status = "error"
+    try:
+        resp = get_session().post(
+            token_url,
+            data={
+                "grant_type": "client_credentials",
+                "client_id": Config.CLIENT_ID,
+                "client_secret": Config.CLIENT_SECRET,
+            },
+            timeout=get_timeout(),
+        )
+        status = resp.status_code
+        resp.raise_for_status()
+        data = resp.json()
+        if not data.get("access_token"):
+            raise ValueError("Svaret fra /api/oauth mangler access_token.")
+    except Exception as e:
+        _logger().error(f"Kunne ikke hente token: {e}")
+        metrics.TOKEN_REFRESHES.labels("failure").inc()
+        # 4xx betyr avvist klientlegitimasjon (konfigurasjonsfeil); nettverksfeil, timeout, 5xx og
+        # ugyldig svar betyr at ClearPass er utilgjengelig
+        _last_failure["status"] = status if isinstance(status, int) and status >= 400 else None
+        return None, 0
+    finally:
+        metrics.observe_clearpass("POST", "/api/oauth", status, started)
+    metrics.TOKEN_REFRESHES.labels("success").inc()
+    expires_in = data.get("expires_in", 3600)
+    now = time.time()
+    # Forny før utløp, men aldri tidligere enn halvveis i levetiden
+    margin = min(Config.TOKEN_REFRESH_MARGIN, expires_in / 2)
+    entry = {
+        "token": data["access_token"],
+        "expiry": now + expires_in,
+        "refresh_at": now + expires_in - margin,
+    }
+    return entry, expires_in
+
+
+def _refresh(blocking=True):
+    """Fornyer tokenet med Redis-lås slik at kun én worker kaller /api/oauth samtidig.
+    Med blocking=False ventes det ikke på låsen: fornyer en annen worker allerede, returneres
+    det som ligger i Redis (eller None), og det gjeldende tokenet brukes videre.
+    """
+    shared = _read_shared()
+    now = time.time()
+    if shared and _is_fresh(shared, now):
+        metrics.CACHE_REQUESTS.labels("token", "shared_hit").inc()
+        return shared
+    lock = redis_client.lock(
+        LOCK_KEY,
+        timeout=Config.TOKEN_LOCK_TIMEOUT,
+        blocking_timeout=Config.TOKEN_LOCK_TIMEOUT,
+    )
+    try:
+        acquired = lock.acquire(blocking=blocking)
+    except redis.RedisError as e:
+        # Redis nede: hent token direkte i stedet for å blokkere innlogging og oppslag
+        _logger().warning(f"Token-lås utilgjengelig, henter token uten lås: {e}")
+        entry, _ = _fetch_token()
+        return entry
+    if not acquired:
+        # En annen worker fornyer fortsatt; bruk det som ligger i Redis hvis det er gyldig
+        shared = _read_shared()
+        if shared and _is_valid(shared, time.time()):
+            return shared
+        if not blocking:
+            return None
+        entry, _ = _fetch_token()
+        return entry
+    try:
+        # Sjekk på nytt: en annen worker kan ha fornyet mens vi ventet på låsen
+        shared = _read_shared()
+        if shared and _is_fresh(shared, time.time()):
+            return shared
+        entry, ttl = _fetch_token()
+        if entry:
+            _write_shared(entry, ttl)
+        return entry
+    finally:
+        try:
+            lock.release()
+        except redis.RedisError:
+            pass
+
+
+def _refresh_in_background():
+    """Fornyer tokenet i en bakgrunnstråd. Kalles med _refresh_lock holdt; tråden slipper den."""
+    flask_app = app._get_current_object() if has_app_context() else None
+
+    def run():
+        try:
+            with flask_app.app_context() if flask_app is not None else contextlib.nullcontext():
+                try:
+                    entry = _refresh(blocking=False)
+                    if entry and entry.get("token"):
+                        _local.update(entry)
+                except Exception as e:
+                    _logger().warning(f"Bakgrunnsfornying av token feilet: {e}")
+        finally:
+            _refresh_lock.release()
+
+    try:
+        threading.Thread(target=run, name="token-refresh", daemon=True).start()
+    except RuntimeError:
+        _refresh_lock.release()
+        raise
+
+
+def get_cached_token():
+    """Henter access token fra lokal kopi, Redis eller ClearPass (i den rekkefølgen).
+
+    Tokenet fornyes proaktivt i bakgrunnen når det er mindre enn TOKEN_REFRESH_MARGIN sekunder igjen,
+    og forespørselen bruker det gamle (fortsatt gyldige) tokenet i mellomtiden. Kun når det ikke
+    finnes et gyldig token, venter forespørselen på fornyingen.
+    """
+    now = time.time()
+    if _is_fresh(_local, now):
+        metrics.CACHE_REQUESTS.labels("token", "hit").inc()
+        return _local["token"]
+    still_valid = _is_valid(_local, now)
+    if not _refresh_lock.acquire(blocking=not still_valid):
+        return _local["token"]
+    if still_valid:
+        _refresh_in_background()
+        return _local["token"]
+    try:
+        if _is_fresh(_local, time.time()):
+            return _local["token"]
+        entry = _refresh()
+        if entry and entry.get("token"):
+            _local.update(entry)
+        elif not _is_valid(_local, time.time()):
+            return None
+        return _local["token"]
+    finally:
+        _refresh_lock.release()
+
+
+def last_failure_status():
+    """HTTP-status fra siste mislykkede henting av token (None før første feil, ved nettverksfeil/timeout
+    og ved ugyldig svar)."""
+    return _last_failure["status"]
+
+
+def invalidate_token(token=None):
+    """Forkaster tokenet lokalt og i Redis. Sendes token inn, slettes kun dersom det er samme token."""
+    if token is None or _local["token"] == token:
+        _local.update({"token": None, "expiry": 0.0, "refresh_at": 0.0})
+    try:
+        shared = _read_shared()
+        if shared and (token is None or shared.get("token") == token):
+            redis_client.delete(TOKEN_KEY)
+    except redis.RedisError as e:
+        _logger().warning(f"Kunne ikke slette token i Redis: {e}")
@@ -0,0 +1,31 @@
+"""
+Hjelpefunksjoner for ClearPass-modulen.
+Inneholder normalisering av MAC-adresser (og MAC-prefikser for søk) slik at samme enhet alltid får samme nøkkel.
+"""
+import re
+
+_MAC_SEPARATORS = re.compile(r"[\s:.\-]")
+_MAC_HEX = re.compile(r"^[0-9a-f]{12}$")
+_MAC_PREFIX_HEX = re.compile(r"^[0-9a-f]+$")
+
+
+def normalize_mac(macaddr):
+    """Normaliserer MAC-adresse til formatet aa-bb-cc-dd-ee-ff. Returnerer None hvis ugyldig."""
+    if not isinstance(macaddr, str):
+        return None
+    digits = _MAC_SEPARATORS.sub("", macaddr).lower()
+    if not _MAC_HEX.match(digits):
+        return None
+    return "-".join(digits[i:i + 2] for i in range(0, 12, 2))
+
+
+def normalize_mac_prefix(prefix):
+    """Normaliserer starten av en MAC-adresse til samme format som normalize_mac (f.eks. "aabbc" -> "aa-bb-c").
+    Returnerer None hvis prefikset er tomt eller ugyldig.
+    """
+    if not isinstance(prefix, str):
+        return None
+    digits = _MAC_SEPARATORS.sub("", prefix).lower()
+    if not 0 < len(digits) <= 12 or not _MAC_PREFIX_HEX.match(digits):
+        return None
+    return "-".join(digits[i:i + 2] for i in range(0, len(digits), 2))
@@ -15,15 +15,77 @@ class Config:
     Alle sensitive og miljøspesifikke verdier hentes fra .env.
     """
     SECRET_KEY = os.environ.get("FLASK_SECRET_KEY", "dev_secret_key")
-    SESSION_TYPE = "filesystem"
+    SESSION_TYPE = os.environ.get("SESSION_TYPE", "redis")  # "redis" eller "filesystem"
+    SESSION_SERIALIZATION_FORMAT = "json"  # Kompakt JSON (msgspec) som kan leses av Redis-klienten med tekstdekoding
+    SESSION_MIGRATE_FILE_DIR = os.environ.get("SESSION_MIGRATE_FILE_DIR")  # Gammel sesjonsmappe som flyttes til Redis ved bruk
     SESSION_PERMANENT = True
     PERMANENT_SESSION_LIFETIME = 8 * 60 * 60  # 8 timer i sekunder
     SESSION_COOKIE_NAME = "session"
     BASE_URL = os.environ.get("BASE_URL")
     CLIENT_ID = os.environ.get("CLIENT_ID")
     CLIENT_SECRET = os.environ.get("CLIENT_SECRET")
+    TOKEN_REFRESH_MARGIN = int(os.environ.get("TOKEN_REFRESH_MARGIN", 300))  # Forny token så mange sekunder før utløp
+    TOKEN_LOCK_TIMEOUT = int(os.environ.get("TOKEN_LOCK_TIMEOUT", 10))
+    CLEARPASS_CONNECT_TIMEOUT = float(os.environ.get("CLEARPASS_CONNECT_TIMEOUT", 3.05))
+    CLEARPASS_READ_TIMEOUT = float(os.environ.get("CLEARPASS_READ_TIMEOUT", 10))
+    SERVING_MODE = os.environ.get("SERVING_MODE", "async")  # "async" (gevent) eller "sync", se gunicorn.conf.py
+    CLEARPASS_POOL_SIZE = int(os.environ.get(
+        "CLEARPASS_POOL_SIZE", 50 if SERVING_MODE == "async" else 10
+    ))  # Maks gjenbrukte forbindelser per worker
+    CLEARPASS_MAX_RETRIES = int(os.environ.get("CLEARPASS_MAX_RETRIES", 2))  # Kun for GET
+    CLEARPASS_RETRY_BACKOFF = float(os.environ.get("CLEARPASS_RETRY_BACKOFF", 0.2))
+    CLEARPASS_RETRY_BACKOFF_MAX = float(os.environ.get("CLEARPASS_RETRY_BACKOFF_MAX", 2))
+    DEVICE_CACHE_TTL = int(os.environ.get("DEVICE_CACHE_TTL", 30))  # Sekunder enhetsinfo caches
+    DEVICE_CACHE_NEGATIVE_TTL = int(os.environ.get("DEVICE_CACHE_NEGATIVE_TTL", 10))  # Sekunder 404 caches
+    DEVICE_CACHE_STALE_TTL = int(os.environ.get("DEVICE_CACHE_STALE_TTL", 86400))  # Hvor lenge utløpt enhetsinfo kan serveres når ClearPass er nede
+    BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", 5))  # Feil mot ClearPass før breakeren åpnes
+    BREAKER_FAILURE_WINDOW = int(os.environ.get("BREAKER_FAILURE_WINDOW", 30))  # Sekunder feilene telles innenfor
+    BREAKER_RESET_TIMEOUT = int(os.environ.get("BREAKER_RESET_TIMEOUT", 30))  # Sekunder åpen før én prøveforespørsel slippes gjennom
+    BREAKER_STATE_REFRESH = float(os.environ.get("BREAKER_STATE_REFRESH", 1))  # Sekunder workerens kopi av tilstanden gjelder
+    REPLAY_INTERVAL = float(os.environ.get("REPLAY_INTERVAL", 5))  # Sekunder mellom forsøk på å sende køede endringer
+    REPLAY_MAX_ATTEMPTS = int(os.environ.get("REPLAY_MAX_ATTEMPTS", 5))  # Forsøk før en køet endring gis opp
+    SINGLEFLIGHT_SHARED = os.environ.get("SINGLEFLIGHT_SHARED", "false").lower() == "true"  # Del kall på tvers av workere via Redis
+    SINGLEFLIGHT_LOCK_TTL = int(os.environ.get("SINGLEFLIGHT_LOCK_TTL", 15))  # Maks sekunder andre workere venter på et delt kall
+    BATCH_MAX_MACS = int(os.environ.get("BATCH_MAX_MACS", 50))  # Maks MAC-adresser per batch-oppslag
+    BATCH_MAX_WORKERS = int(os.environ.get("BATCH_MAX_WORKERS", 8))  # Samtidige ClearPass-kall per batch
+    BULK_MAX_ROWS = int(os.environ.get("BULK_MAX_ROWS", 1000))  # Maks rader per masseimport
+    BULK_MAX_WORKERS = int(os.environ.get("BULK_MAX_WORKERS", 8))  # Samtidige ClearPass-kall per masseimport
+    INVENTORY_SYNC_INTERVAL = int(os.environ.get("INVENTORY_SYNC_INTERVAL", 60))  # Sekunder mellom inkrementelle synker
+    INVENTORY_FULL_SYNC_INTERVAL = int(os.environ.get("INVENTORY_FULL_SYNC_INTERVAL", 3600))  # Sekunder mellom full synk
+    INVENTORY_PAGE_SIZE = int(os.environ.get("INVENTORY_PAGE_SIZE", 1000))  # Enheter per side fra ClearPass
+    SEARCH_MAX_RESULTS = int(os.environ.get("SEARCH_MAX_RESULTS", 200))  # Maks treff per søk i enhetsindeksen
+    ROLE_MAPPING_CACHE_TTL = int(os.environ.get("ROLE_MAPPING_CACHE_TTL", 900))  # Sekunder før role-mapping revalideres
+    ROLE_MAPPING_STALE_TTL = int(os.environ.get("ROLE_MAPPING_STALE_TTL", 86400))  # Hvor lenge utløpt role-mapping kan serveres
+    AUDIT_LOG_DIR = os.environ.get(
+        "AUDIT_LOG_DIR",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "audit"),
+    )
+    AUDIT_LOG_MAX_BYTES = int(os.environ.get("AUDIT_LOG_MAX_BYTES", 50 * 1024 * 1024))  # Størrelse før JSONL-filen roteres
+    AUDIT_LOG_BACKUPS = int(os.environ.get("AUDIT_LOG_BACKUPS", 20))  # Antall roterte filer som beholdes
+    AUDIT_FLUSH_INTERVAL = float(os.environ.get("AUDIT_FLUSH_INTERVAL", 0.5))  # Maks sekunder en hendelse ligger i workerens buffer
+    AUDIT_BATCH_SIZE = int(os.environ.get("AUDIT_BATCH_SIZE", 100))  # Hendelser per XADD-pipeline og per lesing av streamen
+    AUDIT_BUFFER_MAX = int(os.environ.get("AUDIT_BUFFER_MAX", 10000))  # Maks hendelser i bufferet mens Redis er nede
+    AUDIT_STREAM_MAXLEN = int(os.environ.get("AUDIT_STREAM_MAXLEN", 100000))  # Omtrentlig maks lengde på streamen
+    AUDIT_INDEX_MAX = int(os.environ.get("AUDIT_INDEX_MAX", 500))  # Hendelser som beholdes per MAC og per bruker for oppslag
+    APPROVED_DOMAINS_FILE = os.environ.get(
+        "APPROVED_DOMAINS_FILE",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "approved_domains.json"),
+    )
+    APPROVED_DOMAINS_CHECK_INTERVAL = float(os.environ.get("APPROVED_DOMAINS_CHECK_INTERVAL", 2))  # Sekunder mellom mtime-sjekk
+    ADMIN_EMAILS = {e.strip().lower() for e in os.environ.get("ADMIN_EMAILS", "").split(",") if e.strip()}
     SMTP_SERVER = os.environ.get("SMTP_SERVER")
     SMTP_PORT = int(os.environ.get("SMTP_PORT", 25))
     SMTP_FROM = os.environ.get("SMTP_FROM")
     SMTP_FROM_NAME = os.environ.get("SMTP_FROM_NAME", "")
+    SMTP_TIMEOUT = float(os.environ.get("SMTP_TIMEOUT", 10))
+    MAIL_BATCH_SIZE = int(os.environ.get("MAIL_BATCH_SIZE", 20))  # Maks e-poster per batch over samme forbindelse
+    MAIL_MAX_ATTEMPTS = int(os.environ.get("MAIL_MAX_ATTEMPTS", 5))
+    MAIL_RETRY_BACKOFF = float(os.environ.get("MAIL_RETRY_BACKOFF", 5))  # Sekunder før første nye forsøk (dobles)
+    MAIL_SMTP_IDLE_TIMEOUT = float(os.environ.get("MAIL_SMTP_IDLE_TIMEOUT", 60))  # Lukk inaktiv SMTP-forbindelse
+    AUTH_CODE_MAX_ATTEMPTS = int(os.environ.get("AUTH_CODE_MAX_ATTEMPTS", 5))  # Feilforsøk før engangskoden slettes
+    RATELIMIT_ENABLED = os.environ.get("RATELIMIT_ENABLED", "true").lower() != "false"  # Kan slås av for benchmark
+    COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 500))  # Minste JSON/HTML-svar (byte) som komprimeres
+    COMPRESS_LEVEL = int(os.environ.get("COMPRESS_LEVEL", 6))  # gzip-nivå for dynamiske svar (1-9)
+    COMPRESS_BROTLI_QUALITY = int(os.environ.get("COMPRESS_BROTLI_QUALITY", 5))  # brotli-kvalitet for dynamiske svar (0-11)
+    METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")  # Tom verdi: /metrics er avslått (404)
     REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
@@ -0,0 +1,77 @@
+"""
+Gunicorn-konfigurasjon for CP-Tekniker Device Management App.
+SERVING_MODE=async (standard) bruker gevent-workere: alle I/O-kall (ClearPass, Redis, SMTP)
+blir ikke-blokkerende, slik at én prosess kan ha hundrevis av samtidige kall mot ClearPass uten
+at innloggingsendepunktene går tom for workere. SERVING_MODE=sync gir de tradisjonelle sync-workerne.
+
+Med preload_app (standard) importeres appen én gang i masteren, og app.warm_up() bygger delt
+tilstand før fork. Nye workere starter da nesten umiddelbart og deler minnet via copy-on-write.
+Oppstartstiden per worker logges på info-nivå; importtid per modul kan måles med
+python -m utils.startup_profile.
+"""
+import glob
+import os
+import time
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:443")
+workers = int(os.environ.get("GUNICORN_WORKERS", 4))
+loglevel = os.environ.get("GUNICORN_LOG_LEVEL", "error")
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+# Tom verdi slår av TLS (f.eks. lokalt eller bak en proxy)
+certfile = os.environ.get("GUNICORN_CERTFILE", "/certs/fullchain.pem") or None
+keyfile = os.environ.get("GUNICORN_KEYFILE", "/certs/privkey.pem") or None
+
+preload_app = os.environ.get("GUNICORN_PRELOAD", "true").lower() != "false"
+
+if os.environ.get("SERVING_MODE", "async") == "async":
+    worker_class = "gevent"
+    # Maks samtidige forespørsler per worker
+    worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 500))
+    if preload_app:
+        # Appen importeres i masteren før workeren patcher; patch først så låser og sockets blir gevent-vennlige
+        from gevent import monkey
+        monkey.patch_all()
+else:
+    worker_class = "sync"
+
+
+def when_ready(server):
+    """Bygger delt tilstand i masteren før første fork (kun ved preload)."""
+    if not preload_app:
+        return
+    import app
+    started = time.monotonic()
+    app.warm_up()
+    server.log.info(f"Delt tilstand bygget på {(time.monotonic() - started) * 1000:.0f} ms")
+
+
+def pre_fork(server, worker):
+    worker.forked_at = time.monotonic()
+
+
+def post_worker_init(worker):
+    """Logger hvor lang tid workeren brukte fra fork til den var klar."""
+    worker.log.info(f"Worker {worker.pid} klar etter {(time.monotonic() - worker.forked_at) * 1000:.0f} ms")
+
+
+def on_starting(server):
+    """Fjerner metrikkfiler etter prosesser som ikke lever lenger (Prometheus multiprocess-modus)."""
+    metrics_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if not metrics_dir:
+        return
+    os.makedirs(metrics_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(metrics_dir, "*.db")):
+        pid = os.path.basename(path)[:-3].rsplit("_", 1)[-1]
+        try:
+            os.kill(int(pid), 0)
+        except (ValueError, ProcessLookupError):
+            os.remove(path)
+        except PermissionError:
+            pass
+
+
+def child_exit(server, worker):
+    """Markerer workeren som død slik at metrikkene dens ikke lenger telles som levende."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -26,6 +26,21 @@ export let infoFetched = false;
  */
 export let lastFetchedDeviceInfo = null;
 
+/**
+ * Holder knappene deaktivert til rate limit-kvoten er tilbake når backend melder at den er brukt opp
+ * (X-RateLimit-Remaining: 0 og Retry-After), slik at klienten ikke sender forespørsler som avvises.
+ * @param {Response|null} response - Svaret fra fetch.
+ * @param {string[]} buttonIds - Knappene som skal deaktiveres.
+ * @param {Function} disableButtons - Funksjon for å deaktivere knapper.
+ */
+function throttleFromHeaders(response, buttonIds, disableButtons) {
+    if (!response || response.headers.get("X-RateLimit-Remaining") !== "0") return;
+    const retryAfter = parseInt(response.headers.get("Retry-After"), 10);
+    if (!retryAfter) return;
+    disableButtons(buttonIds);
+    setTimeout(() => disableButtons(buttonIds, false), retryAfter * 1000);
+}
+
 /**
  * Henter roller fra backend og fyller nedtrekksmeny.
  * @param {Function} showToast - Funksjon for å vise feilmelding.
@@ -61,8 +76,9 @@ export async function getDeviceInfo(showToast, resetFieldsToDefault, showDeviceI
     const macaddr = document.getElementById("macaddr").value;
     showToast("Laster...");
     disableButtons(["getDeviceInfoBtn", "createDeviceBtn"]);
+    let response = null;
     try {
-        const response = await fetch(`/get_device_info?macaddr=${encodeURIComponent(macaddr)}`, { credentials: "include" });
+        response = await fetch(`/get_device_info?macaddr=${encodeURIComponent(macaddr)}`, { credentials: "include" });
         const data = await response.json();
         if (response.ok) {
             showDeviceInfoModal(data);
@@ -112,7 +128,8 @@ export async function getDeviceInfo(showToast, resetFieldsToDefault, showDeviceI
             const isOtherSponsor = (data.sponsor_name && data.sponsor_name !== loggedInEmail);
             const readonly = isUnknownRole || isOtherSponsor;
             setDeviceFieldsReadonly(readonly);
-            showToast("Enhetsinfo hentet.");
+            // stale: ClearPass er utilgjengelig, og svaret er siste kjente enhetsinfo
+            showToast(data.stale ? "ClearPass er utilgjengelig. Viser sist kjente enhetsinfo." : "Enhetsinfo hentet.");
         } else {
             showToast(data.error || "Feil", "error");
             resetFieldsToDefault();
@@ -122,6 +139,7 @@ export async function getDeviceInfo(showToast, resetFieldsToDefault, showDeviceI
         resetFieldsToDefault();
     }
     disableButtons(["getDeviceInfoBtn", "createDeviceBtn"], false);
+    throttleFromHeaders(response, ["getDeviceInfoBtn"], disableButtons);
 }
 
 // Hjelpefunksjon for å sette alle felter readonly og hindre Endre-modus
@@ -194,15 +212,19 @@ export async function createDevice(showToast, showCreateDeviceModal, disableButt
     const payload = { mac, role_id, enabled, visitor_name, vid, expire_time, sponsor_name, sponsor_profile };
     showToast("Sender...");
     disableButtons(["createDeviceBtn", "getDeviceInfoBtn"]);
+    let response = null;
     try {
-        const response = await fetch("/create_device", {
+        response = await fetch("/create_device", {
             method: "POST",
             headers: { "Content-Type": "application/json" },
             body: JSON.stringify(payload),
             credentials: "include"
         });
         const data = await response.json();
-        if (response.ok) {
+        if (response.status === 202) {
+            // ClearPass er utilgjengelig: endringen er lagt i kø
+            showToast(data.message, "info");
+        } else if (response.ok) {
             showCreateDeviceModal(data);
             showToast("Enhet opprettet.");
             document.getElementById("sponsorName").value = sponsor_name;
@@ -215,6 +237,7 @@ export async function createDevice(showToast, showCreateDeviceModal, disableButt
         showToast("Feil: " + e.message, "error");
     }
     disableButtons(["createDeviceBtn", "getDeviceInfoBtn"], false);
+    throttleFromHeaders(response, ["createDeviceBtn"], disableButtons);
 }
 
 /**
@@ -259,7 +282,9 @@ export async function updateDevice(showToast, disableButtons) {
             credentials: "include"
         });
         const data = await response.json();
-        if (response.ok) {
+        if (response.status === 202) {
+            showToast(data.message, "info");
+        } else if (response.ok) {
             showToast("Endringer lagret.");
             lastFetchedDeviceInfo = data;
             infoFetched = true;
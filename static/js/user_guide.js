@@ -2,6 +2,21 @@
 // Håndterer visning og lasting av brukerveiledning i modal.
 import { addModalFabClose, removeModalFabClose } from './modal.js';
 
+// Veiledningen hentes kun første gang modalen åpnes (stien skrives om til hashet URL ved bygg)
+let guideHtml = null;
+
+function loadGuide() {
+    if (!guideHtml) {
+        guideHtml = fetch('/static/user_guide.html')
+            .then(res => res.ok ? res.text() : Promise.reject())
+            .catch(err => {
+                guideHtml = null; // Prøv på nytt neste gang
+                throw err;
+            });
+    }
+    return guideHtml;
+}
+
 document.addEventListener('DOMContentLoaded', () => {
     const helpBtn = document.getElementById('helpBtn');
     const helpModal = document.getElementById('helpModal');
@@ -20,8 +35,7 @@ document.addEventListener('DOMContentLoaded', () => {
             document.body.classList.add('overflow-hidden');
             addModalFabClose('helpFabClose', closeHelpModal);
             // Hent brukerveiledning og sett inn i modalen
-            fetch('/static/user_guide.html')
-                .then(res => res.ok ? res.text() : Promise.reject())
+            loadGuide()
                 .then(html => {
                     const bodyMatch = html.match(/<body[^>]*>([\s\S]*)<\/body>/i);
                     helpContent.innerHTML = bodyMatch ? bodyMatch[1] : html;
@@ -0,0 +1,204 @@
+"""
+Asset-pipeline for statiske filer.
+python -m utils.assets (kjøres i Dockerfile) bygger static/dist/: hver fil i static/ kopieres med
+innholds-hash i navnet, referanser mellom filene (ES-modulimporter og /static/-stier) skrives om til
+de hashede navnene, og tekstfiler forhåndskomprimeres med gzip og brotli. manifest.json kobler
+originalnavnene til de hashede.
+
+Appen serverer filene fra /assets/ med Cache-Control: immutable og velger komprimert variant etter
+Accept-Encoding. Malene bruker asset_url(), som faller tilbake til /static/ når manifestet mangler
+(f.eks. lokalt uten byggesteg).
+
+    python -m utils.assets
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+import sys
+
+from flask import Blueprint, abort, request, send_from_directory
+
+try:
+    import brotli
+except ImportError:  # Brotli er valgfritt; uten det bygges kun gzip
+    brotli = None
+
+bp = Blueprint('assets', __name__)
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static")
+DIST_DIR = os.path.join(STATIC_DIR, "dist")
+MANIFEST_NAME = "manifest.json"
+URL_PREFIX = "/assets/"
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+HASH_LENGTH = 10
+REWRITABLE = (".css", ".js", ".html")
+COMPRESSIBLE = (".css", ".js", ".html", ".json", ".svg", ".txt")
+MIN_COMPRESS_SIZE = 256  # Mindre filer lønner seg ikke å komprimere
+SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+# import ... from './x.js', export ... from './x.js' og import('./x.js')
+_IMPORT_PATTERN = re.compile(r"""(\bfrom\s*|\bimport\s*\(?\s*)(['"])(\.{1,2}/[^'"]+)\2""")
+_STATIC_PATTERN = re.compile(r"/static/([A-Za-z0-9_./-]+)")
+
+_manifest = {"files": {}, "encodings": {}}
+
+
+def _source_files(static_dir, dist_dir):
+    """Relative stier (med /) til alle filer i static/ utenom dist/."""
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != dist_dir)
+        for name in sorted(files):
+            yield os.path.relpath(os.path.join(root, name), static_dir).replace(os.sep, "/")
+
+
+def _rewrite(rel, text, sources, resolve):
+    """Skriver om modulimporter og /static/-stier i en fil til hashede navn."""
+    base = posixpath.dirname(rel)
+
+    def replace_import(match):
+        prefix, quote, spec = match.groups()
+        target = posixpath.normpath(posixpath.join(base, spec))
+        if target not in sources:
+            return match.group(0)
+        hashed = posixpath.relpath(resolve(target), base or ".")
+        return f"{prefix}{quote}{hashed if hashed.startswith('.') else './' + hashed}{quote}"
+
+    def replace_static(match):
+        target = match.group(1)
+        return URL_PREFIX + resolve(target) if target in sources else match.group(0)
+
+    if rel.endswith(".js"):
+        text = _IMPORT_PATTERN.sub(replace_import, text)
+    return _STATIC_PATTERN.sub(replace_static, text)
+
+
+def _compressed(rel, data):
+    """Returnerer {encoding: bytes} for variantene som er mindre enn originalen."""
+    if not rel.endswith(COMPRESSIBLE) or len(data) < MIN_COMPRESS_SIZE:
+        return {}
+    variants = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(data, quality=11)
+    return {enc: body for enc, body in variants.items() if len(body) < len(data)}
+
+
+def build(static_dir=STATIC_DIR, dist_dir=DIST_DIR):
+    """Bygger dist/ og manifestet på nytt. Returnerer rapport per fil (original, gzip, br i byte)."""
+    sources = set(_source_files(static_dir, dist_dir))
+    files = {}
+    contents = {}
+
+    def resolve(rel, stack=()):
+        if rel in files:
+            return files[rel]
+        if rel in stack:
+            raise ValueError(f"Sirkulær referanse mellom filer: {' -> '.join(stack + (rel,))}")
+        with open(os.path.join(static_dir, rel), "rb") as f:
+            data = f.read()
+        if rel.endswith(REWRITABLE):
+            text = _rewrite(rel, data.decode("utf-8"), sources, lambda dep: resolve(dep, stack + (rel,)))
+            data = text.encode("utf-8")
+        stem, ext = posixpath.splitext(rel)
+        files[rel] = f"{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{ext}"
+        contents[rel] = data
+        return files[rel]
+
+    for rel in sorted(sources):
+        resolve(rel)
+
+    shutil.rmtree(dist_dir, ignore_errors=True)
+    encodings = {}
+    report = []
+    for rel, hashed in sorted(files.items()):
+        target = os.path.join(dist_dir, *hashed.split("/"))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        data = contents[rel]
+        with open(target, "wb") as f:
+            f.write(data)
+        variants = _compressed(rel, data)
+        for encoding, body in variants.items():
+            with open(target + SUFFIXES[encoding], "wb") as f:
+                f.write(body)
+        if variants:
+            # Foretrukket rekkefølge ved servering: brotli før gzip
+            encodings[hashed] = [enc for enc in SUFFIXES if enc in variants]
+        report.append({
+            "file": rel, "asset": hashed, "bytes": len(data),
+            "gzip": len(variants["gzip"]) if "gzip" in variants else None,
+            "br": len(variants["br"]) if "br" in variants else None,
+        })
+    with open(os.path.join(dist_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump({"files": files, "encodings": encodings}, f, indent=2, sort_keys=True)
+    return report
+
+
+def load_manifest(dist_dir=DIST_DIR):
+    """Leser manifestet fra dist/. Uten bygg brukes et tomt manifest, og asset_url peker til /static/."""
+    global _manifest
+    try:
+        with open(os.path.join(dist_dir, MANIFEST_NAME), encoding="utf-8") as f:
+            _manifest = json.load(f)
+    except FileNotFoundError:
+        _manifest = {"files": {}, "encodings": {}}
+    _manifest["hashed"] = set(_manifest["files"].values())
+    return _manifest
+
+
+def asset_url(path):
+    """URL til en statisk fil (sti relativt til static/): hashet under /assets/ når den er bygget."""
+    hashed = _manifest["files"].get(path)
+    return URL_PREFIX + hashed if hashed else f"/static/{path}"
+
+
+def module_preload_urls():
+    """URL-er til alle bygde JS-moduler, for <link rel="modulepreload"> slik at importene lastes parallelt."""
+    return [URL_PREFIX + hashed for path, hashed in sorted(_manifest["files"].items())
+            if path.startswith("js/") and path.endswith(".js")]
+
+
+@bp.route('/assets/<path:filename>', methods=['GET'])
+def serve_asset(filename):
+    """Serverer en bygd fil med immutable caching, forhåndskomprimert når klienten støtter det."""
+    if filename not in _manifest["hashed"]:
+        abort(404)
+    response = None
+    for encoding in _manifest["encodings"].get(filename, ()):
+        if request.accept_encodings[encoding] > 0:
+            response = send_from_directory(
+                DIST_DIR, filename + SUFFIXES[encoding], mimetype=mimetypes.guess_type(filename)[0],
+            )
+            response.headers["Content-Encoding"] = encoding
+            break
+    if response is None:
+        response = send_from_directory(DIST_DIR, filename)
+    response.headers["Cache-Control"] = IMMUTABLE
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def init_app(app):
+    """Leser manifestet, registrerer /assets/ og gjør asset_url tilgjengelig i malene."""
+    load_manifest()
+    app.register_blueprint(bp)
+    app.jinja_env.globals.update(asset_url=asset_url, module_preload_urls=module_preload_urls)
+
+
+def main():
+    report = build()
+    total = sum(r["bytes"] for r in report)
+    smallest = sum(min(v for v in (r["bytes"], r["gzip"], r["br"]) if v is not None) for r in report)
+    for r in report:
+        print(f"{r['asset']:50} {r['bytes']:>8} gzip {r['gzip'] or '-':>8} br {r['br'] or '-':>8}")
+    print(f"{len(report)} filer bygget til {DIST_DIR}: {total} byte, {smallest} byte komprimert"
+          + ("" if brotli else " (brotli ikke installert, kun gzip)"))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+"""
+Komprimering av dynamiske svar.
+JSON- og HTML-svar større enn COMPRESS_MIN_SIZE byte komprimeres med brotli (hvis installert) eller
+gzip etter klientens Accept-Encoding. Strømmede svar (NDJSON fra masseimport og batch) og filer
+(send_file, forhåndskomprimerte assets) røres ikke. En sterk ETag gjøres svak, slik at betingede
+forespørsler fortsatt gir 304 uavhengig av om svaret ble komprimert.
+"""
+import gzip
+
+from flask import request
+
+from config import Config
+
+try:
+    import brotli
+except ImportError:  # Brotli er valgfritt; uten det brukes kun gzip
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {"application/json", "text/html"}
+
+
+def _choose_encoding():
+    """Velger br eller gzip etter Accept-Encoding (høyest kvalitet vinner, brotli ved likhet)."""
+    accept = request.accept_encodings
+    candidates = [("br", accept["br"]), ("gzip", accept["gzip"])] if brotli else [("gzip", accept["gzip"])]
+    encoding, quality = max(candidates, key=lambda c: c[1])
+    return encoding if quality > 0 else None
+
+
+def _compress(response):
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or response.status_code < 200
+        or response.status_code in (204, 304)
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+        or request.method == "HEAD"
+    ):
+        return response
+    data = response.get_data()
+    if len(data) < Config.COMPRESS_MIN_SIZE:
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = _choose_encoding()
+    if encoding is None:
+        return response
+    if encoding == "br":
+        body = brotli.compress(data, quality=Config.COMPRESS_BROTLI_QUALITY)
+    else:
+        body = gzip.compress(data, compresslevel=Config.COMPRESS_LEVEL, mtime=0)
+    response.set_data(body)
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app):
+    """Registrerer komprimering av svar. Bør kalles før andre after_request-hooks, slik at den kjører sist."""
+    app.after_request(_compress)
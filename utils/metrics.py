@@ -0,0 +1,141 @@
+"""
+Prometheus-metrikker for appen.
+Måler responstid per endepunkt, kall mot ClearPass per operasjon, fornying av token, SMTP-utsending,
+Redis-kall, avviste forespørsler fra rate limiting, circuit breakeren, revisjonsloggen og treffrate for cachene.
+Eksponeres på /metrics, som er avslått (404) til METRICS_TOKEN er satt.
+
+Under gunicorn kjører flere worker-prosesser. Med PROMETHEUS_MULTIPROC_DIR satt (gjøres i
+supervisord.conf) skriver hver prosess verdiene sine til filer i mappen, og /metrics summerer
+dem slik at tallene gjelder hele tjenesten og ikke bare workeren som svarte.
+"""
+import hmac
+import os
+import time
+
+from flask import Blueprint, Response, abort, g, jsonify, request
+
+# Mappen må finnes før første metrikk opprettes i multiprocess-modus
+_multiproc_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+if _multiproc_dir:
+    os.makedirs(_multiproc_dir, exist_ok=True)
+
+from prometheus_client import (  # noqa: E402
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess,
+)
+
+from config import Config  # noqa: E402
+
+bp = Blueprint('metrics', __name__)
+
+# Bøttegrenser i sekunder, fra raske Redis-kall til trege ClearPass-kall
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Responstid per endepunkt",
+    ["endpoint", "method", "status"], buckets=LATENCY_BUCKETS,
+)
+CLEARPASS_REQUEST_DURATION = Histogram(
+    "clearpass_request_duration_seconds", "Varighet for kall mot ClearPass per operasjon og status",
+    ["operation", "status"], buckets=LATENCY_BUCKETS,
+)
+TOKEN_REFRESHES = Counter(
+    "clearpass_token_refreshes_total", "Antall forsøk på å hente nytt access token fra ClearPass",
+    ["result"],
+)
+SMTP_SEND_DURATION = Histogram(
+    "smtp_send_duration_seconds", "Varighet for utsending av én e-post",
+    ["result"], buckets=LATENCY_BUCKETS,
+)
+REDIS_COMMAND_DURATION = Histogram(
+    "redis_command_duration_seconds", "Varighet per rundtur mot Redis (en pipeline teller som én)",
+    ["command"], buckets=LATENCY_BUCKETS,
+)
+RATE_LIMIT_REJECTIONS = Counter(
+    "rate_limit_rejections_total", "Forespørsler avvist av rate limiting",
+    ["endpoint"],
+)
+CLEARPASS_BREAKER_TRANSITIONS = Counter(
+    "clearpass_breaker_transitions_total", "Antall ganger circuit breakeren har åpnet eller lukket",
+    ["state"],
+)
+CLEARPASS_BREAKER_REJECTIONS = Counter(
+    "clearpass_breaker_rejections_total", "ClearPass-kall avvist umiddelbart fordi breakeren er åpen",
+)
+CLEARPASS_REPLAYS = Counter(
+    "clearpass_replays_total", "Køede opprettelser/oppdateringer sendt til ClearPass etter at breakeren lukket",
+    ["operation", "result"],
+)
+SINGLEFLIGHT_CALLS = Counter(
+    "singleflight_calls_total", "Lesekall mot ClearPass: utført (leader) eller delt med et pågående kall",
+    ["name", "result"],
+)
+INVENTORY_SYNC_DURATION = Histogram(
+    "inventory_sync_duration_seconds", "Varighet for synk av enhetsindeksen",
+    ["mode", "result"], buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600),
+)
+AUDIT_EVENTS = Counter(
+    "audit_events_total", "Hendelser i revisjonsloggen: sendt til Redis (buffered), skrevet til fil (written) eller forkastet",
+    ["result"],
+)
+CACHE_REQUESTS = Counter(
+    "cache_requests_total", "Oppslag i cachene fordelt på treff og bom",
+    ["cache", "result"],
+)
+
+
+def clearpass_operation(method, path):
+    """Grupperer et ClearPass-kall i en operasjon med lav kardinalitet (token, device_get, ...)."""
+    if path.startswith("/api/oauth"):
+        return "token"
+    if path.startswith("/api/device"):
+        return f"device_{method.lower()}"
+    if path.startswith("/api/role-mapping"):
+        return "role_mapping"
+    return "other"
+
+
+def observe_clearpass(method, path, status, started):
+    """Registrerer ett kall mot ClearPass. status er HTTP-status eller "error" ved nettverksfeil."""
+    CLEARPASS_REQUEST_DURATION.labels(clearpass_operation(method, path), str(status)).observe(
+        time.perf_counter() - started
+    )
+
+
+def _start_timer():
+    g.metrics_started = time.perf_counter()
+
+
+def _record_request(response):
+    started = g.pop("metrics_started", None)
+    if started is not None:
+        HTTP_REQUEST_DURATION.labels(
+            request.endpoint or "unmatched", request.method, str(response.status_code)
+        ).observe(time.perf_counter() - started)
+    return response
+
+
+def _registry():
+    """Samler verdier fra alle prosesser i multiprocess-modus, ellers fra denne prosessen."""
+    if not _multiproc_dir:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+@bp.route('/metrics', methods=['GET'])
+def metrics_route():
+    """Prometheus-endepunkt. Krever Bearer-token; uten METRICS_TOKEN finnes endepunktet ikke (404)."""
+    if not Config.METRICS_TOKEN:
+        abort(404)
+    supplied = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+    if not hmac.compare_digest(supplied, Config.METRICS_TOKEN):
+        return jsonify({"error": "Autentisering kreves."}), 401
+    return Response(generate_latest(_registry()), mimetype=CONTENT_TYPE_LATEST)
+
+
+def init_app(app):
+    """Registrerer måling av responstid og /metrics-endepunktet."""
+    app.before_request(_start_timer)
+    app.after_request(_record_request)
+    app.register_blueprint(bp)
@@ -1,10 +1,45 @@
 """
-Redis-klient for caching og rate limiting.
-Brukes av Flask-Limiter og for midlertidig lagring av autentiseringskoder.
+Redis-klient for caching, sesjoner og rate limiting.
+Brukes av rate limiting (auth/limiter.py), sesjonslagringen og for midlertidig lagring av autentiseringskoder.
+Alle rundturer mot Redis måles i utils/metrics.py.
 """
 
+import time
+
 import redis
+from redis.client import Pipeline
+
 from config import Config
+from utils.metrics import REDIS_COMMAND_DURATION
+
+
+class InstrumentedPipeline(Pipeline):
+    """Pipeline som måler hele utførelsen som én rundtur."""
+
+    def execute(self, raise_on_error=True):
+        started = time.perf_counter()
+        try:
+            return super().execute(raise_on_error)
+        finally:
+            REDIS_COMMAND_DURATION.labels("PIPELINE").observe(time.perf_counter() - started)
+
+
+class InstrumentedRedis(redis.StrictRedis):
+    """Redis-klient som måler varighet per kommando."""
+
+    def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return super().execute_command(*args, **options)
+        finally:
+            REDIS_COMMAND_DURATION.labels(str(args[0]).upper()).observe(time.perf_counter() - started)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+# Felles forbindelsespool for alle Redis-brukere i prosessen
+redis_pool = redis.ConnectionPool.from_url(Config.REDIS_URL, decode_responses=True)
 
 # Initialiserer Redis-klient basert på URL fra config
-redis_client = redis.StrictRedis.from_url(Config.REDIS_URL, decode_responses=True)
+redis_client = InstrumentedRedis(connection_pool=redis_pool)
@@ -0,0 +1,54 @@
+"""
+Oppsett av server-side sesjoner.
+Med SESSION_TYPE=redis lagres sesjoner i Redis via samme forbindelsespool som resten av appen,
+serialisert som kompakt JSON og med TTL lik PERMANENT_SESSION_LIFETIME. Under overgangen fra
+filsystem-sesjoner kan gamle sesjoner flyttes til Redis automatisk første gang de brukes.
+"""
+import os
+
+from cachelib.file import FileSystemCache
+from flask_session import Session
+from flask_session.redis import RedisSessionInterface
+
+from utils.redis import redis_client
+
+
+class MigratingRedisSessionInterface(RedisSessionInterface):
+    """Redis-sesjoner som faller tilbake til gamle filsystem-sesjoner og flytter dem til Redis.
+
+    Filnavnene i sesjonsmappen er hasher av sesjons-ID-en, så sesjonene kan ikke flyttes
+    på forhånd; de flyttes i stedet ved første forespørsel med en gyldig sesjonscookie.
+    """
+
+    def __init__(self, app, migrate_dir=None, **kwargs):
+        super().__init__(app, **kwargs)
+        self.legacy_cache = None
+        if migrate_dir and os.path.isdir(migrate_dir):
+            self.legacy_cache = FileSystemCache(cache_dir=migrate_dir)
+
+    def _retrieve_session_data(self, store_id):
+        data = super()._retrieve_session_data(store_id)
+        if data is not None or self.legacy_cache is None:
+            return data
+        data = self.legacy_cache.get(store_id)
+        if not data:
+            return None
+        ttl = int(self.app.permanent_session_lifetime.total_seconds())
+        self.client.set(store_id, self.serializer.encode(data), ex=ttl)
+        self.legacy_cache.delete(store_id)
+        return data
+
+
+def init_app(app):
+    """Setter opp sesjonslagring basert på SESSION_TYPE."""
+    if app.config.get("SESSION_TYPE") != "redis":
+        Session(app)
+        return
+    app.session_interface = MigratingRedisSessionInterface(
+        app,
+        migrate_dir=app.config.get("SESSION_MIGRATE_FILE_DIR"),
+        client=redis_client,
+        key_prefix=app.config.get("SESSION_KEY_PREFIX", "session:"),
+        permanent=app.config.get("SESSION_PERMANENT", True),
+        serialization_format=app.config.get("SESSION_SERIALIZATION_FORMAT", "json"),
+    )
@@ -0,0 +1,88 @@
+"""
+Profil av oppstartstid for appen.
+Importerer app.py i en ny Python-prosess med -X importtime og rapporterer importtid per modul
+og per toppnivåpakke, slik at det er lett å se hva som gjør worker-oppstart treg.
+
+    python -m utils.startup_profile
+    python -m utils.startup_profile --top 40 --json
+"""
+import argparse
+import json
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+# Moduler som skal lastes lazy og derfor ikke bør dukke opp ved import av appen
+# (email kan ikke være med her: werkzeug importerer det via http.server)
+LAZY_MODULES = ("requests", "urllib3", "smtplib")
+
+
+def profile(module="app"):
+    """Importerer modulen i en ny prosess og returnerer (moduler, lastede lazy-moduler, total µs).
+    moduler er en liste med {"module", "self_us", "cumulative_us"}.
+    """
+    code = (
+        f"import sys, json; import {module}; "
+        f"print(json.dumps([m for m in {list(LAZY_MODULES)!r} if m in sys.modules]))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True, check=True,
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, _, name = match.groups()
+            modules.append({"module": name, "self_us": int(self_us), "cumulative_us": int(cumulative_us)})
+    loaded_lazy = json.loads(result.stdout.strip().splitlines()[-1])
+    total = next((m["cumulative_us"] for m in modules if m["module"] == module), 0)
+    return modules, loaded_lazy, total
+
+
+def by_package(modules):
+    """Summerer egen importtid per toppnivåpakke."""
+    totals = defaultdict(int)
+    for m in modules:
+        totals[m["module"].split(".")[0]] += m["self_us"]
+    return sorted(({"package": p, "self_us": t} for p, t in totals.items()), key=lambda r: -r["self_us"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Måler importtid per modul ved oppstart av appen.")
+    parser.add_argument("--module", default="app", help="Modul som importeres (standard: app)")
+    parser.add_argument("--top", type=int, default=25, help="Antall moduler/pakker som vises")
+    parser.add_argument("--json", action="store_true", help="Skriv rapporten som JSON")
+    args = parser.parse_args(argv)
+
+    modules, loaded_lazy, total = profile(args.module)
+    packages = by_package(modules)
+    slowest = sorted(modules, key=lambda m: -m["self_us"])[:args.top]
+
+    if args.json:
+        print(json.dumps({
+            "module": args.module,
+            "total_ms": round(total / 1000, 1),
+            "lazy_modules_loaded": loaded_lazy,
+            "packages": packages[:args.top],
+            "modules": slowest,
+        }, indent=2))
+        return 0
+
+    print(f"Import av {args.module}: {total / 1000:.1f} ms totalt")
+    print(f"\n{'pakke':40} {'egen tid (ms)':>14}")
+    for row in packages[:args.top]:
+        print(f"{row['package']:40} {row['self_us'] / 1000:>14.1f}")
+    print(f"\n{'modul':50} {'egen (ms)':>10} {'kumulativ (ms)':>15}")
+    for m in slowest:
+        print(f"{m['module']:50} {m['self_us'] / 1000:>10.1f} {m['cumulative_us'] / 1000:>15.1f}")
+    if loaded_lazy:
+        print(f"\nAdvarsel: lazy-moduler ble lastet ved import: {', '.join(loaded_lazy)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())